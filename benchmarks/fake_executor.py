@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Fake environment executor for load tests. Connects back to EnvironmentsTCPServer
+like a real executor and answers every function call with its first argument
+after a configurable latency, so tests with "answer" equal to the input pass.
+
+    fake_executor.py [options] <port> <environment_id>
+
+With the socketpair transport the referee passes a connected socket, its fd is
+in CHECKIO_ENVIRONMENT_FD, and the port is not used.
+
+Only the standard library is used, the executor starts as fast as a real one.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import struct
+import sys
+import time
+
+TERMINATOR = b'\0'
+FRAME_HEADER = struct.Struct('>I')
+FD_VARIABLE = 'CHECKIO_ENVIRONMENT_FD'
+
+
+class Connection(object):
+
+    def __init__(self, port, framed=False, fd=None):
+        if fd is None:
+            self.socket = socket.create_connection(('127.0.0.1', port))
+        else:
+            self.socket = socket.socket(fileno=fd)
+        self.framed = False
+        self._buffer = b''
+        self._next_framed = framed
+
+    def _recv(self):
+        chunk = self.socket.recv(65536)
+        if not chunk:
+            sys.exit(0)
+        self._buffer += chunk
+
+    def send(self, message):
+        data = json.dumps(message).encode('utf-8')
+        if self.framed:
+            self.socket.sendall(FRAME_HEADER.pack(len(data)) + data)
+        else:
+            self.socket.sendall(data + TERMINATOR)
+        # the connection message is always terminated, framing starts after it
+        self.framed = self._next_framed
+
+    def read(self):
+        if self.framed:
+            while len(self._buffer) < FRAME_HEADER.size:
+                self._recv()
+            size = FRAME_HEADER.unpack(self._buffer[:FRAME_HEADER.size])[0]
+            while len(self._buffer) < FRAME_HEADER.size + size:
+                self._recv()
+            data = self._buffer[FRAME_HEADER.size:FRAME_HEADER.size + size]
+            self._buffer = self._buffer[FRAME_HEADER.size + size:]
+        else:
+            while TERMINATOR not in self._buffer:
+                self._recv()
+            data, self._buffer = self._buffer.split(TERMINATOR, 1)
+        return json.loads(data.decode('utf-8'))
+
+
+class FakeExecutor(object):
+
+    def __init__(self, connection, options):
+        self.connection = connection
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.blobs = {}
+        self.output = 'x' * (options.output - 1) + '\n' if options.output else ''
+
+    def reply(self, message, data):
+        if message.get('request_id') is not None:
+            data['request_id'] = message['request_id']
+        self.connection.send(data)
+
+    def resolve_blobs(self, data):
+        for key in [key for key in data if key.endswith('_digest')]:
+            data[key[:-len('_digest')]] = self.blobs[data.pop(key)]
+        return data
+
+    def call(self, message, call):
+        latency = self.options.latency
+        if self.options.jitter:
+            latency += self.random.uniform(0, self.options.jitter)
+        if latency:
+            time.sleep(latency)
+        if self.output:
+            sys.stdout.write(self.output)
+            sys.stdout.flush()
+        if self.random.random() < self.options.crash_rate:
+            self.reply(message, {'status': 'fail'})
+            return False
+        args = self.resolve_blobs(call).get('function_args')
+        result = args[0] if isinstance(args, list) and args else args
+        if self.random.random() < self.options.failure_rate:
+            result = None
+        self.reply(message, {'status': 'success', 'result': result})
+        return True
+
+    def handle(self, message):
+        action = message['action']
+        if action == 'stop':
+            sys.exit(0)
+        elif action == 'blobs_check':
+            self.reply(message, {'status': 'success',
+                                 'missing': [digest for digest in message['digests']
+                                             if digest not in self.blobs]})
+        elif action == 'blobs_put':
+            self.blobs.update(message['blobs'])
+            self.reply(message, {'status': 'success'})
+        elif action == 'run_function':
+            self.call(message, message)
+        elif action == 'run_function_batch':
+            for call in message['calls']:
+                if not self.call(message, call):
+                    break
+        else:
+            # config, run_code and the rest
+            if self.output and action == 'run_code':
+                sys.stdout.write(self.output)
+                sys.stdout.flush()
+            self.reply(message, {'status': 'success'})
+
+    def run(self):
+        while True:
+            self.handle(self.connection.read())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake executor for referee load tests")
+    parser.add_argument('port', type=int)
+    parser.add_argument('environment_id')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds per function call")
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help="random seconds added to the latency")
+    parser.add_argument('--output', type=int, default=0,
+                        help="bytes written to stdout per call")
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help="share of calls returning a wrong result")
+    parser.add_argument('--crash-rate', type=float, default=0.0,
+                        help="share of calls failing to run")
+    parser.add_argument('--capabilities', default='',
+                        help="comma separated capabilities, e.g. request_id,framing,blobs")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--tcp', action='store_true',
+                        help="connect by TCP even if a socket is passed")
+    options = parser.parse_args()
+
+    capabilities = [name for name in options.capabilities.split(',') if name]
+    fd = os.environ.get(FD_VARIABLE)
+    connection = Connection(options.port, framed='framing' in capabilities,
+                            fd=int(fd) if fd and not options.tcp else None)
+    connection.send({'status': 'connected', 'environment_id': options.environment_id,
+                     'capabilities': capabilities})
+    FakeExecutor(connection, options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""
+Micro-benchmarks of referee hot paths: time per call, throughput and peak
+allocations per call for small, medium and huge payloads.
+
+    python benchmarks/hot_paths.py
+    python benchmarks/hot_paths.py --save baseline.json
+    python benchmarks/hot_paths.py --compare baseline.json --tolerance 0.25
+    python benchmarks/hot_paths.py --filter validator
+
+With --compare the script exits with status 1 if a case got slower or allocates
+more than the baseline by more than the tolerance. Baselines only make sense on
+the machine and Python version they were saved on.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkio_referee.editor import packet
+from checkio_referee.environment.blobs import EncodedValue, blob_digest
+from checkio_referee.environment.tcpserver import StreamHandler
+from checkio_referee.handlers.common import CheckHandler
+from checkio_referee.handlers.golf import CodeGolfCheckHandler
+from checkio_referee.utils import binpack, previews, representations, suites, validators
+from checkio_referee.utils.signals import Signal
+
+PAYLOADS = {
+    'small': [1, 2],
+    'medium': [[i, str(i), i / 3] for i in range(300)],
+    'huge': [[(i * j) % 1000 for j in range(100)] for i in range(1000)],
+}
+
+MATRICES = {
+    'small': [[1.5, 2.5]],
+    'medium': [[(i * j) / 3 for j in range(30)] for i in range(30)],
+    'huge': [[(i * j) / 3 for j in range(300)] for i in range(300)],
+}
+
+CODES = {
+    'small': "def checkio(a, b):\n    return a + b\n",
+    'medium': "# comment\ndef checkio(data):\n    return sum(data)\n" * 50,
+    'huge': "# comment\ndef checkio(data):\n    return sum(data)\n" * 5000,
+}
+
+REPEAT = 3
+
+
+class _Controller(object):
+    def is_valid_env(self, env_name):
+        return True
+
+
+class _Referee(object):
+    environments_controller = _Controller()
+    TESTS = {'Basics': [{'input': [1, 2], 'answer': 3}]}
+    VALIDATOR = validators.EqualValidator
+    RUN_TIMEOUT = 300
+    ONE_TEST_TIMEOUT = 30
+    RESOURCE_USAGE = False
+
+
+def _handler(handler_cls=CheckHandler, code=CODES['small']):
+    return handler_cls({'env_name': 'python_3', 'code': code}, None, _Referee())
+
+
+def _sized_cases(name, make_func, payloads=PAYLOADS):
+    for size_name, payload in payloads.items():
+        yield '{}/{}'.format(name, size_name), len(json.dumps(payload)), make_func(payload)
+
+
+def cases():
+    """
+    Yields (name, payload size in bytes or None, function without arguments).
+    """
+    codecs = [packet.JsonCodec()]
+    if binpack.msgpack is not None:
+        codecs.append(packet.BinaryCodec())
+    for codec in codecs:
+        def encode(payload, codec=codec):
+            pkt = packet.OutPacket(packet.OutPacket.METHOD_PRE_TEST, {'in': payload})
+            return lambda: pkt.encode(codec)
+
+        def decode(payload, codec=codec):
+            message = packet.InPacket('select_result', {'in': payload}, request_id=1).encode(
+                codec)
+            return lambda: packet.InPacket.decode(message, codec)
+
+        yield from _sized_cases('packet.encode.' + codec.NAME, encode)
+        yield from _sized_cases('packet.decode.' + codec.NAME, decode)
+
+    stream_handler = StreamHandler.__new__(StreamHandler)
+
+    def stream_encode(payload):
+        message = {'action': 'run_function', 'function_args': payload}
+        return lambda: stream_handler._data_encode(message)
+
+    def stream_decode(payload):
+        data = stream_handler._data_encode({'status': 'success', 'result': payload}) + b'\0'
+        return lambda: stream_handler._data_decode(data)
+
+    def stream_encode_suite(payload):
+        message = {'action': 'run_function', 'function_args': EncodedValue(payload)}
+        return lambda: stream_handler._data_encode(message)
+
+    def digest_suite(payload):
+        value = EncodedValue(payload)
+        return lambda: blob_digest(value)
+
+    yield from _sized_cases('stream.encode', stream_encode)
+    yield from _sized_cases('stream.encode.suite', stream_encode_suite)
+    yield from _sized_cases('stream.decode', stream_decode)
+    yield from _sized_cases('blobs.digest', lambda payload: lambda: blob_digest(payload))
+    yield from _sized_cases('blobs.digest.suite', digest_suite)
+
+    for receivers_count in (1, 10):
+        signal = Signal(providing_args=['data'])
+        for number in range(receivers_count):
+            signal.connect(lambda signal, data: None, dispatch_uid=number)
+        yield 'signal.send/{}'.format(receivers_count), None, lambda signal=signal: signal.send(
+            data={'method': 'select_result'})
+
+    handler = _handler()
+    yield 'settings.priority', None, lambda: handler.TESTS
+    yield 'settings.referee', None, lambda: handler.RUN_TIMEOUT
+    yield 'settings.class', None, lambda: handler.DEFAULT_FUNCTION_NAME
+    yield 'settings.instance', None, lambda: handler.env_name
+
+    def per_test_settings():
+        # settings read by check_test_item and the validation of one test
+        return (handler.VERDICT_ONLY, handler.function_name, handler.RESOURCE_USAGE,
+                handler.ONE_TEST_TIMEOUT, handler.VALIDATOR, handler.TEST_STATS,
+                handler.VERDICT_CACHE)
+    yield 'settings.per_test', None, per_test_settings
+    yield 'handler.create', None, _handler
+
+    suite_tests = {'Category_{}'.format(category_number): [
+        {'input': [number, number % 10], 'answer': number} for number in range(50)]
+        for category_number in range(2)}
+    yield 'suite.compile/100', None, lambda: suites.TestSuite(suite_tests)
+    suite_handler = _handler()
+    suite_handler.VERDICT_CACHE = True
+    suite_test = suite_handler.TESTS['Basics'][0]
+    yield 'suite.test_input', None, lambda: suite_handler.get_test_input(suite_test)
+    yield 'handler.verdict_key', None, suite_handler.get_verdict_key
+
+    for validator_cls in (validators.EqualValidator, validators.ExampleValidator):
+        def validate(payload, validator_cls=validator_cls):
+            test = {'input': payload, 'answer': payload}
+            result = json.loads(json.dumps(payload))
+            return lambda: validator_cls(test).validate(result)
+
+        yield from _sized_cases('validator.' + validator_cls.__name__, validate)
+    float_test = {'input': [1.5], 'answer': 2.0 / 3}
+    yield 'validator.FloatEqualValidator', None, lambda: validators.FloatEqualValidator(
+        float_test).validate(0.6667)
+
+    def validate_matrix(matrix):
+        validator = validators.FloatEqualValidator({'input': [], 'answer': matrix})
+        result = [[value + 0.0001 for value in row] for row in matrix]
+        return lambda: validator.validate(result)
+
+    yield from _sized_cases('validator.FloatEqualValidator.nested', validate_matrix, MATRICES)
+
+    def structural_diff(payload):
+        # the last item differs, the whole result is walked
+        test = {'input': payload, 'answer': payload}
+        result = json.loads(json.dumps(payload))
+        result[-1] = None
+        return lambda: validators.StructuralEqualValidator(test).validate(result)
+
+    yield from _sized_cases('validator.StructuralEqualValidator.fail', structural_diff)
+
+    def preview_result(payload):
+        return lambda: previews.exceeds_size(payload, 10000) and previews.preview(payload)
+
+    yield from _sized_cases('previews.preview', preview_result)
+
+    many_tests = [{'input': [number], 'answer': number / 3} for number in range(100)]
+    many_results = [test['answer'] for test in many_tests]
+    for validator_cls in (validators.EqualValidator, validators.FloatEqualValidator):
+        def one_by_one(validator_cls=validator_cls):
+            return [validator_cls(test).validate(result)
+                    for test, result in zip(many_tests, many_results)]
+
+        yield 'validator.{}.one_by_one/100'.format(validator_cls.__name__), None, one_by_one
+        yield ('validator.{}.validate_many/100'.format(validator_cls.__name__), None,
+               lambda validator_cls=validator_cls: validator_cls.validate_many(many_tests,
+                                                                                many_results))
+
+    for name in representations.__all__:
+        representation = getattr(representations, name)
+
+        def represent(payload, representation=getattr(representation, '__wrapped__',
+                                                       representation)):
+            test = {'input': payload}
+            return lambda: representation(test, 'checkio', None)
+
+        def represent_memoized(payload, representation=representation):
+            test = {'input': payload}
+            return lambda: representation(test, 'checkio')
+
+        yield from _sized_cases('representation.' + name, represent)
+        yield from _sized_cases('representation.{}.memoized'.format(name), represent_memoized)
+
+    for size_name, code in CODES.items():
+        golf_handler = _handler(CodeGolfCheckHandler, code)
+        yield ('golf.code_length/{}'.format(size_name), len(code),
+               lambda golf_handler=golf_handler: golf_handler.code_length)
+
+
+def peak_allocation(func):
+    """
+    The most memory in bytes held at the same time during one call.
+    """
+    tracemalloc.start()
+    try:
+        func()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+
+def measure(func):
+    timer = timeit.Timer(func)
+    number = timer.autorange()[0]
+    seconds = min(timer.repeat(repeat=REPEAT, number=number)) / number
+    return {
+        'seconds': seconds,
+        'ops_per_second': 1 / seconds if seconds else None,
+        'peak_alloc': peak_allocation(func)
+    }
+
+
+def run(name_filter=None):
+    results = {}
+    print("{:<45} {:>12} {:>14} {:>10} {:>12}".format(
+        'case', 'us/call', 'calls/s', 'MB/s', 'peak alloc'))
+    for name, size, func in cases():
+        if name_filter and name_filter not in name:
+            continue
+        result = results[name] = measure(func)
+        result['bytes'] = size
+        throughput = size / result['seconds'] / 1e6 if size else None
+        print("{:<45} {:>12.2f} {:>14.0f} {:>10} {:>12}".format(
+            name, result['seconds'] * 1e6, result['ops_per_second'],
+            '{:.1f}'.format(throughput) if throughput else '-', result['peak_alloc']))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append("{}: {:.2f} us/call, baseline {:.2f}".format(
+                name, result['seconds'] * 1e6, base['seconds'] * 1e6))
+        # small allocations vary between runs, they are not compared
+        if result['peak_alloc'] > max(base['peak_alloc'] * (1 + tolerance),
+                                      base['peak_alloc'] + 1024):
+            regressions.append("{}: {} bytes peak, baseline {}".format(
+                name, result['peak_alloc'], base['peak_alloc']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Referee hot path benchmarks")
+    parser.add_argument('--save', help="write results to this JSON file")
+    parser.add_argument('--compare', help="compare results with this JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument('--filter', help="run only cases containing this string")
+    args = parser.parse_args()
+
+    results = run(args.filter)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as baseline_file:
+            json.dump({
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'binpack': 'msgpack' if binpack.msgpack is not None else 'pure python',
+                'cases': results
+            }, baseline_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline['cases'], args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+End-to-end load test of concurrent checks. A fake editor server drives sessions
+through RefereeSessionManager, environments are fake_executor.py processes with
+controllable latency, output and failures.
+
+    python benchmarks/load_test.py --sessions 200 --concurrency 20 --tests 20
+    python benchmarks/load_test.py --latency 0.01 --jitter 0.01 --failure-rate 0.1
+    python benchmarks/load_test.py --json report.json
+
+The report has throughput, check latency percentiles and memory: growth of the
+referee process RSS per concurrent session and the peak RSS of an executor.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import shlex
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.tcpserver import TCPServer
+
+from checkio_referee import RefereeBase, RefereeSessionManager
+from checkio_referee.editor import packet
+
+logger = logging.getLogger(__name__)
+
+FAKE_EXECUTOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_executor.py')
+ENV_NAME = 'python_3'
+CODE = "def checkio(data):\n    return data[0]\n"
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def make_executor(options):
+    """
+    Executors get only the port and the environment id as arguments, the fake
+    executor options are put into a wrapper script.
+    """
+    args = ['--latency', options.latency, '--jitter', options.jitter, '--output', options.output,
+            '--failure-rate', options.failure_rate, '--crash-rate', options.crash_rate,
+            '--capabilities', options.capabilities]
+    if options.executor_tcp:
+        args.append('--tcp')
+    script = tempfile.NamedTemporaryFile('w', suffix='.sh', prefix='fake_executor_',
+                                         delete=False)
+    with script:
+        script.write('#!/bin/sh\nexec {} {} {} "$@"\n'.format(
+            shlex.quote(sys.executable), shlex.quote(FAKE_EXECUTOR),
+            ' '.join(shlex.quote(str(arg)) for arg in args)))
+    os.chmod(script.name, os.stat(script.name).st_mode | stat.S_IXUSR)
+    return script.name
+
+
+def make_referee_cls(options, executable):
+    tests = {}
+    for category_number in range(options.categories):
+        tests['Category_{}'.format(category_number)] = [
+            {'input': [test_number], 'answer': test_number}
+            for test_number in range(options.tests)]
+
+    class LoadReferee(RefereeBase):
+        ENVIRONMENTS = {ENV_NAME: executable}
+        TESTS = tests
+        TESTS_BATCH_SIZE = options.batch
+        VERDICT_ONLY = options.verdict_only
+        PARALLEL_CATEGORIES = options.parallel
+        ENVIRONMENTS_POOL_SIZE = options.pool
+        ENVIRONMENTS_POOL_MAX_USES = options.pool_max_uses
+        # several load tests may run on one host at the same time
+        ENVIRONMENTS_PORT = 0
+        ENVIRONMENTS_TRANSPORT = options.transport
+    return LoadReferee
+
+
+class LoadEditorServer(TCPServer):
+    """
+    Stand-in editor server. Keeps `concurrency` sessions running on the
+    multiplexed referee connection until `sessions` checks are finished.
+    """
+
+    def __init__(self, options, on_finish):
+        super().__init__()
+        self.options = options
+        self.on_finish = on_finish
+        self.codec = packet.DEFAULT_CODEC
+        self.stream = None
+        self.started = {}
+        self.latencies = []
+        self.results = {'success': 0, 'fail': 0}
+        self.packets = {}
+        self.bytes_received = 0
+        self.sessions_started = 0
+        self.time_started = None
+        self.time_finished = None
+
+    def handle_stream(self, stream, address):
+        self.stream = stream
+        self._read()
+
+    def _read(self):
+        self.codec.read_frame(self.stream, self._on_data)
+
+    def send(self, method, data=None, connection_id=None, request_id=None):
+        pkt = packet.InPacket(method, data, request_id, connection_id)
+        self.stream.write(self.codec.frame(pkt.encode(self.codec)))
+
+    def start_session(self):
+        connection_id = 'load{}'.format(self.sessions_started)
+        self.sessions_started += 1
+        self.started[connection_id] = time.time()
+        self.send(packet.InPacket.METHOD_START_SESSION, {'user_connection_id': connection_id})
+
+    def _on_data(self, data):
+        self.bytes_received += len(data)
+        pkt = packet.OutPacket.decode(data, self.codec)
+        self.packets[pkt.method] = self.packets.get(pkt.method, 0) + 1
+        self._on_packet(pkt)
+        if self.stream is not None and not self.stream.closed():
+            self._read()
+
+    def _on_packet(self, pkt):
+        if pkt.method == packet.OutPacket.METHOD_SET and pkt.connection_id is None:
+            if pkt.data.get('codec'):
+                self.codec = packet.CODECS[pkt.data['codec']]
+                return
+            codecs = pkt.data.get('codecs') or ()
+            if self.options.codec in codecs and self.options.codec != self.codec.NAME:
+                self.send(packet.InPacket.METHOD_SET_CODEC, {'codec': self.options.codec})
+            self.time_started = time.time()
+            for _ in range(min(self.options.concurrency, self.options.sessions)):
+                self.start_session()
+        elif pkt.method == packet.OutPacket.METHOD_SELECT:
+            self.send(packet.InPacket.METHOD_SELECT_RESULT,
+                      {'code': CODE, 'action': 'check', 'env_name': ENV_NAME},
+                      connection_id=pkt.connection_id, request_id=pkt.request_id)
+        elif pkt.method in (packet.OutPacket.METHOD_RESULT, packet.OutPacket.METHOD_ERROR):
+            self._finish_session(pkt.connection_id,
+                                 pkt.method == packet.OutPacket.METHOD_RESULT and
+                                 pkt.data.get('success'))
+
+    def _finish_session(self, connection_id, success):
+        started = self.started.pop(connection_id, None)
+        if started is None:
+            return
+        self.latencies.append(time.time() - started)
+        self.results['success' if success else 'fail'] += 1
+        self.send(packet.InPacket.METHOD_CANCEL, connection_id=connection_id)
+        if self.sessions_started < self.options.sessions:
+            self.start_session()
+        elif not self.started:
+            self.time_finished = time.time()
+            self.on_finish()
+
+
+def report(options, editor, rss_before):
+    duration = editor.time_finished - editor.time_started
+    checks = len(editor.latencies)
+    referee_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+    executor_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * MAXRSS_UNIT
+    return {
+        'options': vars(options),
+        'checks': checks,
+        'results': editor.results,
+        'duration': duration,
+        'checks_per_second': checks / duration,
+        'tests_per_second': checks * options.tests * options.categories / duration,
+        'latency': {
+            'p50': percentile(editor.latencies, 0.5),
+            'p90': percentile(editor.latencies, 0.9),
+            'p99': percentile(editor.latencies, 0.99),
+            'max': max(editor.latencies)
+        },
+        'editor_packets': editor.packets,
+        'editor_bytes': editor.bytes_received,
+        'memory': {
+            'referee_peak_rss': referee_rss,
+            'referee_rss_per_session': (referee_rss - rss_before) / min(options.concurrency,
+                                                                        options.sessions),
+            'executor_peak_rss': executor_rss
+        }
+    }
+
+
+def print_report(result):
+    print("checks: {checks} ({success} passed, {fail} failed) in {duration:.2f} s".format(
+        checks=result['checks'], duration=result['duration'], **result['results']))
+    print("throughput: {:.1f} checks/s, {:.1f} tests/s".format(
+        result['checks_per_second'], result['tests_per_second']))
+    print("check latency: p50 {p50:.3f} s, p90 {p90:.3f} s, p99 {p99:.3f} s, "
+          "max {max:.3f} s".format(**result['latency']))
+    print("editor: {} bytes, packets {}".format(result['editor_bytes'],
+                                                result['editor_packets']))
+    memory = result['memory']
+    print("memory: referee peak {:.1f} MiB, {:.1f} KiB per concurrent session, "
+          "executor peak {:.1f} MiB".format(memory['referee_peak_rss'] / 2 ** 20,
+                                            memory['referee_rss_per_session'] / 2 ** 10,
+                                            memory['executor_peak_rss'] / 2 ** 20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Referee load test")
+    parser.add_argument('--sessions', type=int, default=100, help="checks to run")
+    parser.add_argument('--concurrency', type=int, default=10, help="checks at the same time")
+    parser.add_argument('--tests', type=int, default=10, help="tests per category")
+    parser.add_argument('--categories', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds per executor function call")
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--output', type=int, default=0,
+                        help="stdout bytes per executor call")
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help="share of wrong results")
+    parser.add_argument('--crash-rate', type=float, default=0.0,
+                        help="share of failed function runs")
+    parser.add_argument('--capabilities', default='',
+                        help="executor capabilities, e.g. request_id,framing,blobs")
+    parser.add_argument('--batch', type=int, default=0, help="TESTS_BATCH_SIZE")
+    parser.add_argument('--verdict-only', action='store_true', help="VERDICT_ONLY")
+    parser.add_argument('--parallel', type=int, default=0, help="PARALLEL_CATEGORIES")
+    parser.add_argument('--pool', type=int, default=0, help="ENVIRONMENTS_POOL_SIZE")
+    parser.add_argument('--pool-max-uses', type=int, default=1,
+                        help="ENVIRONMENTS_POOL_MAX_USES")
+    parser.add_argument('--transport', default='tcp', choices=('tcp', 'socketpair'),
+                        help="ENVIRONMENTS_TRANSPORT")
+    parser.add_argument('--executor-tcp', action='store_true',
+                        help="executors ignore the passed socket and connect by TCP")
+    parser.add_argument('--codec', default=packet.JsonCodec.NAME,
+                        help="editor codec to switch to when the referee offers it")
+    parser.add_argument('--timeout', type=float, default=600, help="seconds for the whole run")
+    parser.add_argument('--json', help="write the report to this file")
+    options = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    executable = make_executor(options)
+    io_loop = IOLoop.current()
+    editor = LoadEditorServer(options, on_finish=lambda: io_loop.add_callback(io_loop.stop))
+    sockets = bind_sockets(0, '127.0.0.1')
+    editor.add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+    manager = RefereeSessionManager(make_referee_cls(options, executable), '127.0.0.1', port,
+                                    'load', io_loop=io_loop)
+    io_loop.add_callback(manager.start)
+    timeout = io_loop.call_later(options.timeout, io_loop.stop)
+    try:
+        io_loop.start()
+    finally:
+        io_loop.remove_timeout(timeout)
+        os.remove(executable)
+
+    if editor.time_finished is None:
+        print("Load test timed out: {} of {} checks finished".format(len(editor.latencies),
+                                                                     options.sessions))
+        sys.exit(1)
+
+    result = report(options, editor, rss_before)
+    print_report(result)
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as report_file:
+            json.dump(result, report_file, indent=2)
+    io_loop.run_sync(manager.environments_controller.stop_all_environments)
+
+
+if __name__ == '__main__':
+    main()
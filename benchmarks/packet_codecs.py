@@ -0,0 +1,48 @@
+"""
+Compares JSON and MessagePack codecs of editor packets.
+
+    python benchmarks/packet_codecs.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from checkio_referee.editor import packet
+from checkio_referee.utils import binpack
+
+PAYLOADS = {
+    'small': {'representation': 'checkio([1, 2])', 'in': [1, 2]},
+    'medium': {'actual_result': [[i, str(i), i / 3] for i in range(100)],
+               'expected_result': [[i, str(i), i / 3] for i in range(100)],
+               'test_passed': True, 'additional_data': None, 'explanation': None},
+    'large': {'in': [[(i * j) % 1000 for j in range(100)] for i in range(1000)],
+              'representation': 'checkio(' + 'x' * 10000 + ')'},
+}
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def main():
+    codecs = [packet.JsonCodec(), packet.BinaryCodec()]
+    print("binpack implementation: {}".format(
+        'msgpack' if binpack.msgpack is not None else 'pure python'))
+    print("{:<8} {:<8} {:>10} {:>14} {:>14}".format(
+        'payload', 'codec', 'size', 'encode, us', 'decode, us'))
+    for name, data in PAYLOADS.items():
+        pkt = packet.OutPacket(packet.OutPacket.METHOD_POST_TEST, data)
+        number = 10 if name == 'large' else 2000
+        for codec in codecs:
+            message = pkt.encode(codec)
+            encode_time = measure(lambda: pkt.encode(codec), number)
+            decode_time = measure(lambda: packet.OutPacket.decode(message, codec), number)
+            print("{:<8} {:<8} {:>10} {:>14.1f} {:>14.1f}".format(
+                name, codec.NAME, len(codec.frame(message)),
+                encode_time * 1e6, decode_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
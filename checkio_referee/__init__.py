@@ -1,3 +1,4 @@
 from checkio_referee.referee import RefereeBase, RefereeCodeGolf, RefereeRank
+from checkio_referee.sessions import RefereeSessionManager
 from checkio_referee.utils import covercodes, validators, representations
 from checkio_referee.utils.terms import *
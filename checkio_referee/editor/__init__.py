@@ -1 +1 @@
-from checkio_referee.editor.tcpclient import EditorClient
+from checkio_referee.editor.tcpclient import EditorClient, EditorMultiplexClient
@@ -0,0 +1,58 @@
+import logging
+
+from tornado.ioloop import IOLoop
+
+logger = logging.getLogger(__name__)
+
+
+class OutputBuffer(object):
+    """
+    Joins stdout/stderr chunks of one environment into bigger editor packets.
+    Data is sent when the buffer reaches flush_size, flush_interval seconds after
+    the first buffered chunk, on explicit flush, or when the other stream writes,
+    so the order between stdout and stderr is kept. Flushed data is queued in the
+    editor client at once, before a test event or a result sent after the flush.
+    """
+
+    STDOUT = 'stdout'
+    STDERR = 'stderr'
+
+    def __init__(self, editor_client, flush_size, flush_interval):
+        self.editor_client = editor_client
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._stream_name = None
+        self._chunks = []
+        self._size = 0
+        self._timeout = None
+
+    def write(self, stream_name, data):
+        if stream_name != self._stream_name:
+            self.flush()
+            self._stream_name = stream_name
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= self.flush_size:
+            self.flush()
+        elif self._timeout is None:
+            self._timeout = IOLoop.current().call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        if self._timeout is not None:
+            IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        if not self._chunks:
+            return
+
+        data = ''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        if self._stream_name == self.STDOUT:
+            send = self.editor_client.send_stdout
+        else:
+            send = self.editor_client.send_stderr
+        IOLoop.current().add_future(send(data), self._on_sent)
+
+    def _on_sent(self, future):
+        if future.exception() is not None:
+            logger.error('OutputBuffer:: output is not sent: {}'.format(future.exception()))
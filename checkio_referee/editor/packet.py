@@ -1,6 +1,9 @@
+import struct
+
 from tornado.escape import json_encode, json_decode
 
 from checkio_referee.exceptions import EditorPacketStructureError
+from checkio_referee.utils import binpack
 
 
 RESULT_ACTION_CHECK = 'check'
@@ -8,31 +11,85 @@ RESULT_ACTION_TRY_IT = 'try_it'
 RESULT_ACTION_RUN = 'run'
 
 
+class JsonCodec(object):
+    """
+    Text JSON packets separated by new lines. Default codec of the editor connection.
+    """
+    NAME = 'json'
+    TERMINATOR = b'\n'
+
+    def dumps(self, data):
+        return json_encode(data).encode()
+
+    def loads(self, data):
+        return json_decode(data.decode('utf-8'))
+
+    def frame(self, message):
+        return message + self.TERMINATOR
+
+    def read_frame(self, stream, callback):
+        stream.read_until(self.TERMINATOR, callback)
+
+
+class BinaryCodec(object):
+    """
+    MessagePack packets with a 4 bytes big-endian length header.
+    """
+    NAME = 'msgpack'
+    HEADER = struct.Struct('>I')
+
+    def dumps(self, data):
+        return binpack.packb(data)
+
+    def loads(self, data):
+        try:
+            return binpack.unpackb(data)
+        except ValueError as e:
+            raise EditorPacketStructureError(str(e))
+
+    def frame(self, message):
+        return self.HEADER.pack(len(message)) + message
+
+    def read_frame(self, stream, callback):
+        def _on_header(header):
+            stream.read_bytes(self.HEADER.unpack(header)[0], callback)
+        stream.read_bytes(self.HEADER.size, _on_header)
+
+
+DEFAULT_CODEC = JsonCodec()
+CODECS = dict((codec.NAME, codec) for codec in (BinaryCodec(), DEFAULT_CODEC))
+
+
 class PacketBase(object):
 
     AVAILABLE_METHODS = []
 
-    def __init__(self, method, data, request_id=None):
+    def __init__(self, method, data, request_id=None, connection_id=None):
         if method not in self.AVAILABLE_METHODS:
             raise EditorPacketStructureError('Packet method {} not allowed'.format(method))
         self.method = method
         self.data = data
         self.request_id = request_id
+        self.connection_id = connection_id
 
     def get_all_data(self):
-        return {
+        all_data = {
             'method': self.method,
             'data': self.data,
             'request_id': self.request_id
         }
+        if self.connection_id is not None:
+            all_data['connection_id'] = self.connection_id
+        return all_data
 
-    def encode(self):
-        return json_encode(self.get_all_data()).encode()
+    def encode(self, codec=DEFAULT_CODEC):
+        return codec.dumps(self.get_all_data())
 
     @classmethod
-    def decode(cls, data):
-        data = json_decode(data.decode('utf-8'))
-        return cls(data.get('method'), data.get('data'), data.get('request_id'))
+    def decode(cls, data, codec=DEFAULT_CODEC):
+        data = codec.loads(data)
+        return cls(data.get('method'), data.get('data'), data.get('request_id'),
+                   data.get('connection_id'))
 
 
 class OutPacket(PacketBase):
@@ -58,5 +115,8 @@ class InPacket(PacketBase):
     METHOD_SELECT_RESULT = 'select_result'
     METHOD_GET_STATUS = 'get_status'
     METHOD_CANCEL = 'cancel'
+    METHOD_START_SESSION = 'start_session'
+    METHOD_SET_CODEC = 'set_codec'
 
-    AVAILABLE_METHODS = (METHOD_SELECT_RESULT, METHOD_GET_STATUS, METHOD_CANCEL)
+    AVAILABLE_METHODS = (METHOD_SELECT_RESULT, METHOD_GET_STATUS, METHOD_CANCEL,
+                         METHOD_START_SESSION, METHOD_SET_CODEC)
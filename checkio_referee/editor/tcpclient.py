@@ -1,11 +1,15 @@
 import logging
 import uuid
+from collections import deque
+from itertools import count
 
+from tornado.concurrent import Future
 from tornado.tcpclient import TCPClient
 from tornado import gen
 
 from checkio_referee.editor import packet
 from checkio_referee.exceptions import EditorPacketStructureError
+from checkio_referee.utils import binpack, metrics
 from checkio_referee.utils.signals import Signal
 
 logger = logging.getLogger(__name__)
@@ -13,9 +17,35 @@ logger = logging.getLogger(__name__)
 
 class EditorClient(object):
 
-    TERMINATOR = b'\n'
     ATTR_NAME_CONNECTION_ID = 'user_connection_id'
     ATTR_NAME_DOCKER_ID = 'docker_id'
+    ATTR_NAME_CODECS = 'codecs'
+    ATTR_NAME_CODEC = 'codec'
+
+    # codecs offered to the editor server, JSON is used until the server picks one.
+    # The pure-Python MessagePack fallback is slower than JSON, so it is not offered.
+    CODECS = ((packet.BinaryCodec.NAME, packet.JsonCodec.NAME) if binpack.msgpack is not None
+              else (packet.JsonCodec.NAME,))
+
+    # packets are sent by lanes: control and results first, then test events, output last
+    PRIORITY_CONTROL = 0
+    PRIORITY_TEST = 1
+    PRIORITY_OUTPUT = 2
+    METHOD_PRIORITIES = {
+        packet.OutPacket.METHOD_PRE_TEST: PRIORITY_TEST,
+        packet.OutPacket.METHOD_POST_TEST: PRIORITY_TEST,
+        packet.OutPacket.METHOD_STDOUT: PRIORITY_OUTPUT,
+        packet.OutPacket.METHOD_STDERR: PRIORITY_OUTPUT,
+    }
+    # bytes of output allowed to wait in the queue, output over it is dropped
+    OUTPUT_LANE_LIMIT = 1024 * 1024
+    # output of a session queued before these packets is sent before them
+    BOUNDARY_METHODS = frozenset((
+        packet.OutPacket.METHOD_PRE_TEST,
+        packet.OutPacket.METHOD_POST_TEST,
+        packet.OutPacket.METHOD_RESULT,
+        packet.OutPacket.METHOD_ERROR,
+    ))
 
     def __init__(self, host, port, user_connection_id, docker_id, io_loop):
         self.__host = host
@@ -30,7 +60,19 @@ class EditorClient(object):
             packet.InPacket.METHOD_SELECT_RESULT: Signal('data'),
             packet.InPacket.METHOD_GET_STATUS: Signal('data'),
             packet.InPacket.METHOD_CANCEL: Signal('data'),
+            packet.InPacket.METHOD_SET_CODEC: Signal('data'),
         }
+        self._codec = self._read_codec = packet.DEFAULT_CODEC
+        self._codec_switch = None
+        self.add_data_callback(packet.InPacket.METHOD_SET_CODEC, self._set_codec_signal_receiver)
+        self._lanes = (deque(), deque(), deque())
+        self._output_lane_size = 0
+        self._queued_numbers = count()
+        self._queued_output = {}
+        self._is_sending = False
+        self._dropped_output = {}
+        self.dropped_output_bytes = 0
+        self.dropped_output_packets = 0
 
     @gen.coroutine
     def connect(self):
@@ -53,19 +95,117 @@ class EditorClient(object):
 
     @gen.coroutine
     def _write(self, method, data=None, request_id=None):
-        if self._stream.closed():
+        yield self._send_packet(packet.OutPacket(method, data, request_id))
+
+    @gen.coroutine
+    def _send_packet(self, pkt):
+        if self._stream is None or self._stream.closed():
             raise EditorPacketStructureError('Connection is closed')
+        started = metrics.now()
+        yield self._enqueue(pkt)
+        metrics.observe('editor_write_seconds', metrics.now() - started, method=pkt.method)
+
+    def _enqueue(self, pkt):
+        message = pkt.encode(self._codec)
+        priority = self.METHOD_PRIORITIES.get(pkt.method, self.PRIORITY_CONTROL)
+        future = Future()
+        if priority == self.PRIORITY_OUTPUT:
+            if self._output_lane_size + len(message) > self.OUTPUT_LANE_LIMIT:
+                self.dropped_output_bytes += len(message)
+                self.dropped_output_packets += 1
+                self._dropped_output[pkt.connection_id] = (
+                    self._dropped_output.get(pkt.connection_id, 0) + len(message))
+                future.set_result(None)
+                return future
+            self._output_lane_size += len(message)
+            self._queued_output[pkt.connection_id] = (
+                self._queued_output.get(pkt.connection_id, 0) + 1)
+
+        self._lanes[priority].append((pkt, message, self._codec, future,
+                                      next(self._queued_numbers)))
+        if not self._is_sending:
+            self._send_queued()
+        return future
+
+    def _next_queued(self):
+        control, tests, output = self._lanes
+        # a result must not overtake the test events sent before it
+        if control and (not tests or control[0][0].method != packet.OutPacket.METHOD_RESULT or
+                        control[0][4] < tests[0][4]):
+            return self._pop_output_before(control[0]) or control.popleft()
+        if tests:
+            return self._pop_output_before(tests[0]) or tests.popleft()
+        if output:
+            return self._pop_output(0)
+        if self._dropped_output:
+            self._enqueue_dropped_output_summary()
+            return self._next_queued()
+
+    def _pop_output_before(self, queued):
+        """
+        Output of the session queued before a test event or a result goes first, only
+        the output queued after it waits for the other lanes.
+        """
+        pkt, number = queued[0], queued[4]
+        if pkt.method not in self.BOUNDARY_METHODS or not self._queued_output.get(
+                pkt.connection_id):
+            return None
+        for index, output_queued in enumerate(self._lanes[self.PRIORITY_OUTPUT]):
+            if output_queued[4] > number:
+                break
+            if output_queued[0].connection_id == pkt.connection_id:
+                return self._pop_output(index)
+        return None
+
+    def _pop_output(self, index):
+        output = self._lanes[self.PRIORITY_OUTPUT]
+        queued = output[index]
+        del output[index]
+        self._output_lane_size -= len(queued[1])
+        connection_id = queued[0].connection_id
+        self._queued_output[connection_id] -= 1
+        if not self._queued_output[connection_id]:
+            del self._queued_output[connection_id]
+        return queued
+
+    def _enqueue_dropped_output_summary(self):
+        dropped_output, self._dropped_output = self._dropped_output, {}
+        for connection_id, dropped_bytes in dropped_output.items():
+            pkt = packet.OutPacket(packet.OutPacket.METHOD_STDERR,
+                                   '\n... {} bytes of output dropped\n'.format(dropped_bytes),
+                                   connection_id=connection_id)
+            message = pkt.encode(self._codec)
+            self._output_lane_size += len(message)
+            self._queued_output[connection_id] = self._queued_output.get(connection_id, 0) + 1
+            self._lanes[self.PRIORITY_OUTPUT].append(
+                (pkt, message, self._codec, Future(), next(self._queued_numbers)))
 
-        message = packet.OutPacket(method, data, request_id).encode()
+    @gen.coroutine
+    def _send_queued(self):
+        self._is_sending = True
         try:
-            yield self._stream.write(message + self.TERMINATOR)
-        except Exception as e:
-            logger.error(e, exc_info=True)
-        else:
-            logger.debug('EditorClient:: send: {}'.format(message))
+            while True:
+                queued = self._next_queued()
+                if queued is None:
+                    break
+                pkt, message, codec, future, _ = queued
+                if codec is not self._codec:
+                    message = pkt.encode(self._codec)
+                try:
+                    yield self._stream.write(self._codec.frame(message))
+                except Exception as e:
+                    logger.error(e, exc_info=True)
+                else:
+                    logger.debug('EditorClient:: send: {}'.format(message))
+                future.set_result(None)
+                if self._codec_switch is not None and self._codec_switch[0] is pkt:
+                    self._codec = self._codec_switch[1]
+                    self._codec_switch = None
+        finally:
+            self._is_sending = False
 
     def _read(self):
-        self._stream.read_until(self.TERMINATOR, self._on_data)
+        self._read_codec.read_frame(self._stream, self._on_data)
 
     def _on_data(self, data):
         logger.debug('UserClient:: received: {}'.format(data))
@@ -73,18 +213,40 @@ class EditorClient(object):
             logger.error("UserClient:: received")
         else:
             try:
-                pkt = packet.InPacket.decode(data)
+                pkt = packet.InPacket.decode(data, self._read_codec)
             except EditorPacketStructureError as e:
                 logger.error(e, exc_info=True)
             else:
-                if pkt.request_id is not None:
-                    f = self._requests[pkt.request_id]
-                    f.set_result(pkt.data)
-                    del self._requests[pkt.request_id]
-                signal = self._requests_signals[pkt.method]
-                signal.send(data=pkt.data)
+                self._on_packet(pkt)
         self._read()
 
+    def _on_packet(self, pkt):
+        if pkt.request_id is not None:
+            f = self._requests[pkt.request_id]
+            f.set_result(pkt.data)
+            del self._requests[pkt.request_id]
+        signal = self._requests_signals[pkt.method]
+        signal.send(data=pkt.data)
+
+    def _set_codec_signal_receiver(self, signal, data=None):
+        """
+        Editor server picked a codec and uses it for all packets after this one. The
+        client confirms with a METHOD_SET packet in the old codec and switches after it.
+        """
+        codec = packet.CODECS.get(data.get('codec'))
+        if codec is None or codec.NAME not in self.CODECS:
+            logger.error('EditorClient:: unsupported codec {}'.format(data))
+            return
+        logger.debug('EditorClient:: codec {}'.format(codec.NAME))
+        self._read_codec = codec
+        confirm = packet.OutPacket(packet.OutPacket.METHOD_SET, {self.ATTR_NAME_CODEC: codec.NAME})
+        self._codec_switch = (confirm, codec)
+        self._lanes[self.PRIORITY_CONTROL].appendleft(
+            (confirm, confirm.encode(self._codec), self._codec, Future(),
+             next(self._queued_numbers)))
+        if not self._is_sending:
+            self._send_queued()
+
     def add_cancel_callback(self, callback):
         self.add_data_callback(packet.InPacket.METHOD_CANCEL, callback)
 
@@ -191,5 +353,115 @@ class EditorClient(object):
         """
         yield self._write(packet.OutPacket.METHOD_SET, {
             self.ATTR_NAME_CONNECTION_ID: self.__user_connection_id,
-            self.ATTR_NAME_DOCKER_ID: self.__docker_id
+            self.ATTR_NAME_DOCKER_ID: self.__docker_id,
+            self.ATTR_NAME_CODECS: self.CODECS
         })
+
+
+class EditorMultiplexClient(EditorClient):
+    """
+    One editor connection shared by many user sessions. Packets of a session carry its
+    connection_id, incoming packets are routed to the session client by it.
+    """
+
+    ATTR_NAME_MULTIPLEXED = 'multiplexed'
+
+    def __init__(self, host, port, docker_id, io_loop):
+        super().__init__(host, port, None, docker_id, io_loop)
+        self.__docker_id = docker_id
+        self._sessions = {}
+        self._close_callback = None
+        self._requests_signals[packet.InPacket.METHOD_START_SESSION] = Signal('data')
+
+    def set_close_callback(self, callback):
+        self._close_callback = callback
+        self._stream.set_close_callback(self._on_close)
+
+    def _on_close(self):
+        for session in list(self._sessions.values()):
+            session.on_close()
+        self._discard_queued()
+        if self._close_callback is not None:
+            self._close_callback()
+
+    def _discard_queued(self):
+        """
+        Packets of the closed connection are not sent after a reconnect, which starts
+        with the default codec again.
+        """
+        for lane in self._lanes:
+            for queued in lane:
+                if not queued[3].done():
+                    queued[3].set_result(None)
+            lane.clear()
+        self._output_lane_size = 0
+        self._queued_output = {}
+        self._dropped_output = {}
+        self._codec = self._read_codec = packet.DEFAULT_CODEC
+        self._codec_switch = None
+
+    def add_session_callback(self, callback):
+        self.add_data_callback(packet.InPacket.METHOD_START_SESSION, callback)
+
+    def add_session(self, user_connection_id):
+        session = EditorSessionClient(self, user_connection_id, self.__docker_id)
+        self._sessions[user_connection_id] = session
+        return session
+
+    def remove_session(self, user_connection_id):
+        self._sessions.pop(user_connection_id, None)
+
+    def _on_packet(self, pkt):
+        """
+        Errors of a packet are logged, raising them would close the connection of all
+        the sessions.
+        """
+        try:
+            if pkt.connection_id is None:
+                super()._on_packet(pkt)
+                return
+            session = self._sessions.get(pkt.connection_id)
+            if session is None:
+                logger.warning('EditorClient:: packet for unknown session {}'.format(
+                    pkt.connection_id))
+                return
+            session._on_packet(pkt)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+
+    @gen.coroutine
+    def _confirm_connection(self):
+        yield self._write(packet.OutPacket.METHOD_SET, {
+            self.ATTR_NAME_DOCKER_ID: self.__docker_id,
+            self.ATTR_NAME_MULTIPLEXED: True,
+            self.ATTR_NAME_CODECS: self.CODECS
+        })
+
+
+class EditorSessionClient(EditorClient):
+    """
+    EditorClient interface for one user session over an EditorMultiplexClient.
+    """
+
+    def __init__(self, multiplex_client, user_connection_id, docker_id):
+        super().__init__(None, None, user_connection_id, docker_id, multiplex_client._io_loop)
+        self.user_connection_id = user_connection_id
+        self._multiplex_client = multiplex_client
+        self._close_callback = None
+
+    @gen.coroutine
+    def connect(self):
+        yield self._confirm_connection()
+        return True
+
+    def set_close_callback(self, callback):
+        self._close_callback = callback
+
+    def on_close(self):
+        if self._close_callback is not None:
+            self._close_callback()
+
+    @gen.coroutine
+    def _send_packet(self, pkt):
+        pkt.connection_id = self.user_connection_id
+        yield self._multiplex_client._send_packet(pkt)
@@ -0,0 +1,133 @@
+"""
+Content-addressed blobs for the referee-environment link. Big values (code, cover
+code, test inputs) are sent once and referred to by digest afterwards.
+
+Values which are sent again and again (test inputs of a mission) can be encoded
+once as EncodedValue: messages are encoded with encode_message, which writes
+their JSON as it is.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+
+from tornado.escape import json_encode
+
+
+class EncodedValue(object):
+    """
+    A value with its JSON encoding and digest, computed once.
+    """
+    __slots__ = ('value', 'json', 'size', 'digest')
+
+    def __init__(self, value, encoded=None):
+        self.value = value
+        self.json = json_encode(value) if encoded is None else encoded
+        encoded = self.json.encode('utf-8')
+        self.size = len(encoded)
+        self.digest = hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+    def __repr__(self):
+        return 'EncodedValue({}, {} bytes)'.format(self.digest, self.size)
+
+
+class _ContainsEncodedValue(Exception):
+    pass
+
+
+class _MessageEncoder(json.JSONEncoder):
+    """
+    Writes EncodedValues as their JSON. Only the dicts and lists which have an
+    EncodedValue in them are walked here, the rest is encoded by json at once.
+    """
+
+    def default(self, o):
+        if isinstance(o, EncodedValue):
+            raise _ContainsEncodedValue()
+        return super().default(o)
+
+    def _encode(self, o):
+        # the same as json_encode
+        return ''.join(super().iterencode(o, _one_shot=True)).replace("</", "<\\/")
+
+    def iterencode(self, o, _one_shot=False):
+        if isinstance(o, EncodedValue):
+            yield o.json
+            return
+        try:
+            yield self._encode(o)
+            return
+        except _ContainsEncodedValue:
+            pass
+        if isinstance(o, dict):
+            yield '{'
+            for index, (key, value) in enumerate(o.items()):
+                if index:
+                    yield ', '
+                yield self._encode(key if isinstance(key, str) else self._encode(key))
+                yield ': '
+                yield from self.iterencode(value)
+            yield '}'
+        else:
+            yield '['
+            for index, value in enumerate(o):
+                if index:
+                    yield ', '
+                yield from self.iterencode(value)
+            yield ']'
+
+
+_message_encoder = _MessageEncoder()
+
+
+def encode_message(data):
+    """
+    json_encode of a message, EncodedValues in it are written as their JSON.
+    """
+    return ''.join(_message_encoder.iterencode(data))
+
+
+def blob_digest(value, min_size=0):
+    """
+    Digest of the JSON encoding of value, or None if the encoding is shorter than
+    min_size and the value should rather be sent inline.
+    """
+    if isinstance(value, EncodedValue):
+        return value.digest if value.size >= min_size else None
+    encoded = json_encode(value).encode('utf-8')
+    if len(encoded) < min_size:
+        return None
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class LRUBlobCache(object):
+    """
+    Blobs by digest with least-recently-used eviction. Environments keep the blobs
+    themselves, the referee keeps only the digests an environment is known to hold.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __contains__(self, digest):
+        if digest not in self._items:
+            return False
+        self._items.move_to_end(digest)
+        return True
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, digest, default=None):
+        if digest not in self:
+            return default
+        return self._items[digest]
+
+    def add(self, digest, value=None):
+        self._items[digest] = value
+        self._items.move_to_end(digest)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def discard(self, digest):
+        self._items.pop(digest, None)
@@ -1,21 +1,57 @@
+from itertools import count
+
 from tornado import gen
+from tornado.concurrent import Future
+from tornado.locks import Lock, Semaphore
+from tornado.queues import Queue
 import logging
 
 from checkio_referee import exceptions
+from checkio_referee.environment.blobs import blob_digest, LRUBlobCache
 logger = logging.getLogger(__name__)
 
 
 class EnvironmentClient(object):
 
-    def __init__(self, stream, environment_id):
+    CAPABILITY_REQUEST_ID = 'request_id'
+    CAPABILITY_BLOBS = 'blobs'
+
+    MAX_IN_FLIGHT = 8
+
+    # values with a JSON encoding shorter than this are always sent inline
+    BLOB_MIN_SIZE = 1024
+    # digests remembered per environment, should not exceed the environment cache size
+    BLOB_CACHE_SIZE = 256
+
+    def __init__(self, stream, environment_id, capabilities=None):
         self._stream = stream
         self._on_stop_callback = None
         self._is_stopping = None
         self.environment_id = environment_id
+        self.capabilities = frozenset(capabilities or ())
+
+        self._requests = {}
+        self._request_ids = count(1)
+        self._batch_request_id = None
+        self._batch_results = None
+        self._in_flight = Semaphore(self.MAX_IN_FLIGHT)
+        self._is_dispatching = False
+        self._blobs = LRUBlobCache(self.BLOB_CACHE_SIZE)
+        self._send_lock = Lock()
 
     def set_on_stop_callback(self, callback):
         self._on_stop_callback = callback
 
+    def is_closed(self):
+        return self._stream.closed()
+
+    @property
+    def is_pipelined(self):
+        """
+        Environment echoes request_id in responses, so several requests can be in flight.
+        """
+        return self.CAPABILITY_REQUEST_ID in self.capabilities
+
     @gen.coroutine
     def write(self, data):
         logger.debug('CLIENT SEND: {}'.format(data))
@@ -29,30 +65,187 @@ class EnvironmentClient(object):
 
     @gen.coroutine
     def _request(self, data):
-        yield self.write(data)
+        if not self.is_pipelined:
+            yield self.write(data)
+            response = yield self._read_response()
+            return response
+
+        with (yield self._in_flight.acquire()):
+            future = Future()
+            data['request_id'] = self._register_request(future)
+            yield self.write(data)
+            response = yield future
+        return self._check_response(response)
+
+    @gen.coroutine
+    def _request_with_blobs(self, data, blobs):
+        # blobs are sent under the lock, so requests reach the environment in call order
+        with (yield self._send_lock.acquire()):
+            yield self._send_blobs(blobs)
+            response = self._request(data)
+        try:
+            response = yield response
+        except exceptions.EnvironmentRunFail as e:
+            missing = e.args and e.args[0] and e.args[0].get('missing')
+            if not missing:
+                raise
+            # the environment evicted blobs which were expected to be there
+            for digest in missing:
+                self._blobs.discard(digest)
+            yield self._send_blobs(blobs)
+            response = yield self._request(data)
+        return response
+
+    def _use_blobs(self, data, fields, blobs=None):
+        """
+        Put fields into data, big values as "<name>_digest" references.
+        Returns blobs {digest: value} which should be in the environment for the request.
+        """
+        blobs = {} if blobs is None else blobs
+        use_blobs = self.CAPABILITY_BLOBS in self.capabilities
+        for name, value in fields.items():
+            digest = blob_digest(value, self.BLOB_MIN_SIZE) if use_blobs else None
+            if digest is None:
+                data[name] = value
+            else:
+                data[name + '_digest'] = digest
+                blobs[digest] = value
+        return blobs
+
+    @gen.coroutine
+    def _send_blobs(self, blobs):
+        digests = [digest for digest in blobs if digest not in self._blobs]
+        if not digests:
+            return
+        response = yield self._request({
+            'action': 'blobs_check',
+            'digests': digests
+        })
+        missing = response.get('missing', digests)
+        if missing:
+            yield self._request({
+                'action': 'blobs_put',
+                'blobs': dict((digest, blobs[digest]) for digest in missing)
+            })
+        for digest in digests:
+            self._blobs.add(digest)
+
+    @gen.coroutine
+    def _read_response(self):
         response = yield self.read_message()
+        return self._check_response(response)
+
+    def _check_response(self, response):
         if response is None or response.get('status') != 'success':
             raise exceptions.EnvironmentRunFail(response)
         return response
 
+    def _register_request(self, target):
+        request_id = next(self._request_ids)
+        if self.is_closed() and not self._is_dispatching:
+            # nobody answers any more, the request fails like the ones in flight did
+            self._close_target(target)
+            return request_id
+        self._requests[request_id] = target
+        if not self._is_dispatching:
+            self._is_dispatching = True
+            self._dispatch()
+        return request_id
+
+    @gen.coroutine
+    def _dispatch(self):
+        """
+        Read responses and route them by request_id: a Future gets the single response
+        for its request, a Queue collects all the streamed responses of a batch.
+        """
+        while True:
+            message = yield self.read_message()
+            if message is None:
+                break
+            # errors raised by the referee side (e.g. a skipped oversized frame) have
+            # no request_id, they belong to the oldest request as environments answer in order
+            request_id = message.get('request_id', next(iter(self._requests), None))
+            target = self._requests.get(request_id)
+            if target is None:
+                logger.error('Unexpected response from environment {}: {}'.format(
+                    self.environment_id, message))
+            elif isinstance(target, Queue):
+                target.put_nowait(message)
+            else:
+                del self._requests[request_id]
+                target.set_result(message)
+
+        for target in self._requests.values():
+            self._close_target(target)
+        self._requests.clear()
+        self._is_dispatching = False
+
+    def _close_target(self, target):
+        if isinstance(target, Queue):
+            target.put_nowait(None)
+        else:
+            target.set_result(None)
+
     @gen.coroutine
     def run_code(self, code, env_config=None):
-        result = yield self._request({
+        data = {
             'action': 'run_code',
-            'code': code,
             'env_config': env_config
-        })
+        }
+        blobs = self._use_blobs(data, {'code': code})
+        result = yield self._request_with_blobs(data, blobs)
         return result
 
     @gen.coroutine
     def run_func(self, function_name, params):
-        result = yield self._request({
+        data = {
             'action': 'run_function',
-            'function_name': function_name,
-            'function_args': params
-        })
+            'function_name': function_name
+        }
+        blobs = self._use_blobs(data, {'function_args': params})
+        result = yield self._request_with_blobs(data, blobs)
         return result
 
+    @gen.coroutine
+    def run_func_batch(self, calls):
+        """
+        Send several function calls in one message. calls is a list of dicts with
+        function_name and function_args. The environment answers with one message
+        per call, in order, and they should be read with read_batch_result.
+        """
+        blobs = {}
+        batch_calls = []
+        for call in calls:
+            batch_call = {'function_name': call['function_name']}
+            self._use_blobs(batch_call, {'function_args': call['function_args']}, blobs)
+            batch_calls.append(batch_call)
+
+        data = {
+            'action': 'run_function_batch',
+            'calls': batch_calls
+        }
+        with (yield self._send_lock.acquire()):
+            yield self._send_blobs(blobs)
+            if self.is_pipelined:
+                self._requests.pop(self._batch_request_id, None)
+                # the queue is kept here, results read before the stream closed stay in it
+                self._batch_results = Queue()
+                self._batch_request_id = data['request_id'] = self._register_request(
+                    self._batch_results)
+            yield self.write(data)
+
+    @gen.coroutine
+    def read_batch_result(self):
+        if not self.is_pipelined:
+            result = yield self._read_response()
+            return result
+
+        response = yield self._batch_results.get()
+        if response is None:
+            # the stream is closed, the next reads fail too
+            self._batch_results.put_nowait(None)
+        return self._check_response(response)
+
     @gen.coroutine
     def run_code_and_function(self, code, function_name, args):
         result = yield self._request({
@@ -73,12 +266,27 @@ class EnvironmentClient(object):
 
     @gen.coroutine
     def set_config(self, env_config):
-        result = yield self._request({
+        blobs = {}
+        if env_config and env_config.get('cover_code') is not None:
+            env_config = dict(env_config)
+            blobs = self._use_blobs(env_config, {'cover_code': env_config.pop('cover_code')})
+        result = yield self._request_with_blobs({
             'action': 'config',
             'env_config': env_config
-        })
+        }, blobs)
         return result
 
+    def close(self):
+        """
+        Drop the connection without asking the environment to stop, when its process is killed.
+        """
+        if self._is_stopping:
+            return
+        self._is_stopping = True
+        self._stream.close()
+        if self._on_stop_callback is not None:
+            self._on_stop_callback(self.environment_id)
+
     @gen.coroutine
     def stop(self):
         if self._is_stopping:
@@ -1,14 +1,22 @@
 import logging
+import socket
 import uuid
+from collections import deque
 from functools import partial
 
 from tornado import gen
 from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
 from tornado.process import Subprocess
 
-from checkio_referee.exceptions import CheckioEnvironmentError
-from checkio_referee.environment.tcpserver import EnvironmentsTCPServer
+from checkio_referee.exceptions import CheckioEnvironmentError, RefereeTimeout
+from checkio_referee.environment.tcpserver import EnvironmentsTCPServer, StreamHandler
 from checkio_referee.environment.client import EnvironmentClient
+from checkio_referee.environment.output import OutputCapture
+from checkio_referee.environment.resources import read_usage, resource_limits
+from checkio_referee.utils import metrics
+from checkio_referee.utils.deadlines import Deadline
 
 logger = logging.getLogger(__name__)
 
@@ -17,26 +25,152 @@ class EnvironmentsController(object):
 
     ENVIRONMENT_CLIENT_CLS = EnvironmentClient
 
-    def __init__(self, environments):
+    TRANSPORT_TCP = 'tcp'
+    # the environment gets one end of a socketpair, its fd number is in the
+    # ENVIRONMENT_FD_VARIABLE. Environments which do not know the variable
+    # still connect by TCP to the port from the arguments
+    TRANSPORT_SOCKETPAIR = 'socketpair'
+    ENVIRONMENT_FD_VARIABLE = 'CHECKIO_ENVIRONMENT_FD'
+
+    TRANSPORT = TRANSPORT_TCP
+    POOL_SIZE = 0  # idle environments kept per env_name, 0 disables pooling
+    POOL_MAX_IDLE = 60  # seconds before an idle environment is replaced
+    POOL_MAX_USES = 1  # times an environment can be handed out before it is stopped
+    CONNECT_TIMEOUT = 30  # seconds for a started environment to connect, 0 disables
+    # RLIMIT_CPU seconds and RLIMIT_AS bytes of environment processes, for the whole
+    # process life (all the uses of a pooled environment)
+    CPU_LIMIT = None
+    MEMORY_LIMIT = None
+    OUTPUT_LIMIT = OutputCapture.LIMIT  # bytes of stdout and stderr of an environment
+
+    def __init__(self, environments, pool_size=None, pool_max_idle=None, pool_max_uses=None,
+                 max_frame_size=None, connect_timeout=None, cpu_limit=None, memory_limit=None,
+                 port=None, port_range=None, transport=None, output_limit=None):
         self.environments = environments
+        self.transport = transport or self.TRANSPORT
+        if self.transport not in (self.TRANSPORT_TCP, self.TRANSPORT_SOCKETPAIR):
+            raise CheckioEnvironmentError("Unknown environments transport {}".format(
+                self.transport))
         self._connections = {}
+        self._socketpair_streams = {}
+        self._outputs = {}
+        self._captures = {}
+        self.output_limit = self.OUTPUT_LIMIT if output_limit is None else output_limit
+        self._processes = {}
+        self._connect_deadlines = {}
+        self._spawn_times = {}
+        self.connect_timeout = (self.CONNECT_TIMEOUT if connect_timeout is None
+                                else connect_timeout)
+        self.cpu_limit = self.CPU_LIMIT if cpu_limit is None else cpu_limit
+        self.memory_limit = self.MEMORY_LIMIT if memory_limit is None else memory_limit
 
-        self.server = EnvironmentsTCPServer()
+        self.pool_size = self.POOL_SIZE if pool_size is None else pool_size
+        self.pool_max_idle = self.POOL_MAX_IDLE if pool_max_idle is None else pool_max_idle
+        self.pool_max_uses = self.POOL_MAX_USES if pool_max_uses is None else pool_max_uses
+        self._pool = {}
+        self._pool_spawning = {}
+        self._pool_timeouts = {}
+        self._env_names = {}
+        self._uses = {}
+
+        self.server = EnvironmentsTCPServer(max_frame_size=max_frame_size)
         self.server.set_connection_message_callback(self.on_connection_message)
-        self.server.listen(self.server.PORT)
+        # a range (first, last) lets referee processes on one host find free ports
+        if port_range is not None:
+            ports = range(port_range[0], port_range[1] + 1)
+        else:
+            ports = [self.server.PORT if port is None else port]
+        self.server.listen_free(ports)
 
     def get_environment(self, env_name, on_stdout, on_stderr):
-        executable_path = self.get_executable_path(env_name)
-        return self.start_env(executable_path, on_stdout, on_stderr)
+        if not self.pool_size:
+            return self._start_named_env(env_name, on_stdout, on_stderr)
+
+        environment = self._pop_idle(env_name)
+        if environment is None:
+            future = self._start_named_env(env_name, on_stdout, on_stderr)
+        else:
+            self._outputs[environment.environment_id] = (on_stdout, on_stderr)
+            future = Future()
+            future.set_result(environment)
+        self._fill_pool(env_name)
+        return future
+
+    def _start_named_env(self, env_name, on_stdout, on_stderr):
+        environment_id = uuid.uuid4().hex
+        self._env_names[environment_id] = env_name
+        future = self.start_env(self.get_executable_path(env_name), on_stdout, on_stderr,
+                                environment_id)
+        self._uses[environment_id] = 1
+        return future
+
+    def _pop_idle(self, env_name):
+        idle = self._pool.get(env_name)
+        while idle:
+            environment = idle.popleft()
+            IOLoop.current().remove_timeout(self._pool_timeouts.pop(environment.environment_id))
+            if environment.is_closed():
+                environment.stop()
+                continue
+            self._uses[environment.environment_id] += 1
+            return environment
+
+    def _fill_pool(self, env_name):
+        idle = self._pool.setdefault(env_name, deque())
+        spawning = self._pool_spawning.get(env_name, 0)
+        for _ in range(self.pool_size - len(idle) - spawning):
+            self._pool_spawning[env_name] = self._pool_spawning.get(env_name, 0) + 1
+            IOLoop.current().spawn_callback(self._spawn_pooled, env_name)
+
+    @gen.coroutine
+    def _spawn_pooled(self, env_name):
+        try:
+            environment = yield self._start_named_env(env_name, None, None)
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            return
+        finally:
+            self._pool_spawning[env_name] -= 1
+        self._uses[environment.environment_id] = 0
+        self._put_idle(env_name, environment)
+
+    def _put_idle(self, env_name, environment):
+        environment_id = environment.environment_id
+        self._outputs[environment_id] = (None, None)
+        self._pool_timeouts[environment_id] = IOLoop.current().call_later(
+            self.pool_max_idle, self._expire_idle, env_name, environment)
+        self._pool.setdefault(env_name, deque()).append(environment)
+
+    def _expire_idle(self, env_name, environment):
+        logger.debug("EnvironmentsController:: idle expired {}".format(
+            environment.environment_id))
+        del self._pool_timeouts[environment.environment_id]
+        self._pool[env_name].remove(environment)
+        environment.stop()
+        self._fill_pool(env_name)
+
+    @gen.coroutine
+    def release_environment(self, environment):
+        """
+        Return an environment to the pool if it may be used again, otherwise stop it.
+        """
+        environment_id = environment.environment_id
+        env_name = self._env_names.get(environment_id)
+        if (not self.pool_size or env_name is None or environment.is_closed() or
+                self._uses[environment_id] >= self.pool_max_uses):
+            yield environment.stop()
+            return
+        self._put_idle(env_name, environment)
 
     def get_executable_path(self, env_name):
         return self.environments[env_name]
 
-    def start_env(self, executable, on_stdout, on_stderr):
-        environment_id = uuid.uuid4().hex
+    def start_env(self, executable, on_stdout, on_stderr, environment_id=None):
+        environment_id = environment_id or uuid.uuid4().hex
+        self._outputs[environment_id] = (on_stdout, on_stderr)
         args = [
             executable,
-            str(self.server.PORT),
+            str(self.server.port),
             environment_id
         ]
         stream = Subprocess.STREAM
@@ -44,58 +178,177 @@ class EnvironmentsController(object):
             'PYTHONUNBUFFERED': '0',
             'PYTHONIOENCODING': 'utf-8'
         }
+        pass_fds = ()
+        if self.transport == self.TRANSPORT_SOCKETPAIR:
+            referee_socket, environment_socket = socket.socketpair()
+            env[self.ENVIRONMENT_FD_VARIABLE] = str(environment_socket.fileno())
+            pass_fds = (environment_socket.fileno(),)
+        env_name = self._env_names.get(environment_id)
+        spawn_time = self._spawn_times[environment_id] = metrics.now()
         try:
             sub_process = Subprocess(args=args, executable=executable, stdout=stream,
-                                     stderr=stream, env=env)
+                                     stderr=stream, env=env, pass_fds=pass_fds,
+                                     preexec_fn=resource_limits(self.cpu_limit,
+                                                                self.memory_limit))
         except Exception as e:
             logger.error(e)
+            del self._spawn_times[environment_id]
+            if pass_fds:
+                referee_socket.close()
+                environment_socket.close()
             raise
+        finally:
+            if pass_fds:
+                environment_socket.close()
+        metrics.observe('environment_spawn_seconds', metrics.now() - spawn_time,
+                        env_name=env_name)
 
-        limits = {'out': 2000000,
-                  'environment_id': environment_id,
-                  'is_closed': False,
-                  'sub_process': sub_process}
+        capture = self._captures[environment_id] = OutputCapture(self.output_limit)
+        open_streams = [sub_process.stdout, sub_process.stderr]
 
-        def count_stds(data, limits=limits):
-            if limits['is_closed']:
+        def forward(output_index, text):
+            if not text:
                 return
-            limits['out'] -= len(data)
-            if limits['out'] > 0:
-                return True
-            limits['is_closed'] = True
-            on_stderr(limits['environment_id'], u'Out limit reached')
-            limits['sub_process'].stdout.close()
-            limits['sub_process'].stderr.close()
-
-        def decode_data(func):
-            def _decode(data):
-                if count_stds(data):
-                    return func(data.decode('utf-8'))
-            return _decode
-        _on_stdout = decode_data(partial(on_stdout, environment_id))
-        _on_stderr = decode_data(partial(on_stderr, environment_id))
-        sub_process.stdout.read_until_close(lambda a: a, streaming_callback=_on_stdout)
-        sub_process.stderr.read_until_close(lambda a: a, streaming_callback=_on_stderr)
+            callback = self._outputs.get(environment_id, (None, None))[output_index]
+            if callback is None:
+                logger.debug("EnvironmentsController:: idle output {}".format(text))
+                return
+            callback(environment_id, text)
+
+        def on_data(output_index):
+            def _on_data(data):
+                was_truncated = capture.is_truncated
+                forward(output_index, capture.feed(output_index, data))
+                if capture.is_truncated and not was_truncated:
+                    forward(OutputCapture.STDERR, capture.LIMIT_MESSAGE)
+                if capture.is_drained:
+                    # reading the rest costs more than the count of dropped bytes is worth
+                    for output_stream in list(open_streams):
+                        output_stream.close()
+            return _on_data
+
+        def on_close(output_index):
+            def _on_close(data):
+                forward(output_index, capture.finish(output_index))
+                open_streams.remove((sub_process.stdout, sub_process.stderr)[output_index])
+                if not open_streams:
+                    forward(OutputCapture.STDERR, capture.truncation_marker())
+                    self._outputs.pop(environment_id, None)
+            return _on_close
+        sub_process.stdout.read_until_close(on_close(OutputCapture.STDOUT),
+                                            streaming_callback=on_data(OutputCapture.STDOUT))
+        sub_process.stderr.read_until_close(on_close(OutputCapture.STDERR),
+                                            streaming_callback=on_data(OutputCapture.STDERR))
+        self._processes[environment_id] = sub_process
+        self._connect_deadlines[environment_id] = Deadline(
+            'connect', self.connect_timeout,
+            partial(self._on_connect_deadline, environment_id)).start()
         self._connections[environment_id] = Future()
+        if pass_fds:
+            # the connection message comes through the socketpair as through TCP,
+            # only without listening and accepting
+            self._socketpair_streams[environment_id] = StreamHandler(
+                IOStream(referee_socket), self.TRANSPORT_SOCKETPAIR, self.server)
         return self._connections[environment_id]
 
+    def _close_socketpair(self, environment_id, stream=None):
+        socketpair_stream = self._socketpair_streams.pop(environment_id, None)
+        if socketpair_stream is not None and socketpair_stream is not stream:
+            socketpair_stream.close()
+
+    def _on_connect_deadline(self, environment_id, deadline):
+        logger.error("EnvironmentsController:: {} did not connect in {} seconds, "
+                     "stderr: {}".format(environment_id, deadline.timeout,
+                                         self._captures.pop(environment_id).summary(
+                                             OutputCapture.STDERR)))
+        del self._connect_deadlines[environment_id]
+        del self._spawn_times[environment_id]
+        metrics.inc('timeouts_total', phase=deadline.phase,
+                    env_name=self._env_names.get(environment_id))
+        self._close_socketpair(environment_id)
+        self._kill_process(environment_id)
+        self._env_names.pop(environment_id, None)
+        self._uses.pop(environment_id, None)
+        self._connections.pop(environment_id).set_exception(
+            RefereeTimeout(deadline.phase, deadline.timeout))
+
+    def _kill_process(self, environment_id):
+        sub_process = self._processes.pop(environment_id, None)
+        if sub_process is None or sub_process.proc.poll() is not None:
+            return
+        sub_process.proc.kill()
+        # reap the killed process, nothing else waits for it
+        IOLoop.current().call_later(1, sub_process.proc.poll)
+
+    def kill_environment(self, environment):
+        """
+        Kill the process of an environment right away, without asking it to stop.
+        Used when the environment does not answer in time. Returns the resource
+        usage of the process just before it was killed.
+        """
+        logger.debug("EnvironmentsController:: kill {}".format(environment.environment_id))
+        usage = self.get_resource_usage(environment)
+        self._kill_process(environment.environment_id)
+        environment.close()
+        return usage
+
+    def get_output_summary(self, environment, output_index=OutputCapture.STDERR):
+        """
+        The head and the tail of stdout or stderr of an environment for error reports,
+        None if the environment is stopped.
+        """
+        capture = self._captures.get(environment.environment_id)
+        if capture is None:
+            return None
+        return capture.summary(output_index)
+
+    def get_resource_usage(self, environment):
+        """
+        CPU time and peak RSS of the environment process, None if it is not available.
+        """
+        sub_process = self._processes.get(environment.environment_id)
+        if sub_process is None:
+            return None
+        return read_usage(sub_process.pid)
+
     def on_connection_message(self, data, stream):
         if data.get('status') != 'connected':
             raise CheckioEnvironmentError("Wrong connection message {}".format(str(data)))
         environment_id = data['environment_id']
-        environment_client = self.ENVIRONMENT_CLIENT_CLS(stream, environment_id)
+        if environment_id not in self._connect_deadlines:
+            logger.error("EnvironmentsController:: unexpected connection {}".format(
+                environment_id))
+            stream.close()
+            return
+        self._connect_deadlines.pop(environment_id).cancel()
+        # an environment without socketpair support connected by TCP
+        self._close_socketpair(environment_id, stream)
+        metrics.observe('environment_connect_seconds',
+                        metrics.now() - self._spawn_times.pop(environment_id),
+                        env_name=self._env_names.get(environment_id))
+        environment_client = self.ENVIRONMENT_CLIENT_CLS(stream, environment_id,
+                                                         data.get('capabilities'))
         environment_client.set_on_stop_callback(self.on_environment_stopped)
         logger.debug("EnvironmentsController:: connected {}".format(environment_id))
         self._connections[environment_id].set_result(environment_client)
 
     def on_environment_stopped(self, environment_id):
         del self._connections[environment_id]
+        self._captures.pop(environment_id, None)
+        self._processes.pop(environment_id, None)
+        self._env_names.pop(environment_id, None)
+        self._uses.pop(environment_id, None)
 
     @gen.coroutine
     def stop_all_environments(self):
+        for timeout in self._pool_timeouts.values():
+            IOLoop.current().remove_timeout(timeout)
+        self._pool_timeouts.clear()
+        self._pool.clear()
         stop_environments = []
-        for environment in self._connections.values():
-            stop_environments.append(environment.stop())
+        for connection in list(self._connections.values()):
+            if connection.done() and connection.exception() is None:
+                stop_environments.append(connection.result().stop())
         return (yield stop_environments)
 
     def is_valid_env(self, env_name):
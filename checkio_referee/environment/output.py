@@ -0,0 +1,118 @@
+"""
+Output capture of environment processes: stdout and stderr are decoded
+incrementally, so a character split between chunks is not broken, and share one
+byte budget. Output over the budget is read and counted but not forwarded, only
+the head and the tail of every stream are kept for error reports, so memory does
+not grow with the output of a submission.
+"""
+import codecs
+
+__all__ = ["OutputCapture"]
+
+
+def _is_continuation(byte):
+    return byte & 0xC0 == 0x80
+
+
+class _StreamCapture(object):
+    __slots__ = ('decoder', 'head', 'tail', 'size')
+
+    def __init__(self):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+
+    def keep(self, data, keep_size):
+        self.size += len(data)
+        if len(self.head) < keep_size:
+            head_size = keep_size - len(self.head)
+            self.head += data[:head_size]
+            data = data[head_size:]
+        if not data:
+            return
+        if len(data) >= keep_size:
+            self.tail[:] = data[-keep_size:]
+            return
+        self.tail += data
+        if len(self.tail) > keep_size:
+            del self.tail[:len(self.tail) - keep_size]
+
+
+class OutputCapture(object):
+    """
+    Streams are STDOUT (0) and STDERR (1). feed() returns the text to forward,
+    which is empty once the budget is spent. After drain_limit dropped bytes the
+    caller should close the streams, so a submission printing forever is not read
+    until its timeout.
+    """
+
+    STDOUT = 0
+    STDERR = 1
+
+    LIMIT = 2000000  # bytes of stdout and stderr together forwarded to the editor
+    KEEP_SIZE = 4096  # bytes of the head and the tail kept per stream
+    DRAIN_LIMIT = 64 * 1024 * 1024
+
+    LIMIT_MESSAGE = u'Out limit reached'
+    TRUNCATION_MARKER = u'\n... {} bytes of output dropped\n'
+
+    def __init__(self, limit=None, keep_size=None, drain_limit=None):
+        self.limit = self.LIMIT if limit is None else limit
+        self.keep_size = self.KEEP_SIZE if keep_size is None else keep_size
+        self.drain_limit = self.DRAIN_LIMIT if drain_limit is None else drain_limit
+        self.forwarded = 0
+        self.dropped = 0
+        self._streams = (_StreamCapture(), _StreamCapture())
+
+    @property
+    def is_truncated(self):
+        return self.forwarded >= self.limit
+
+    @property
+    def is_drained(self):
+        return self.dropped >= self.drain_limit
+
+    def feed(self, index, data):
+        stream = self._streams[index]
+        stream.keep(data, self.keep_size)
+        allowed = self.limit - self.forwarded
+        if allowed <= 0:
+            self.dropped += len(data)
+            return u''
+        if len(data) > allowed:
+            self.dropped += len(data) - allowed
+            data = data[:allowed]
+        self.forwarded += len(data)
+        return stream.decoder.decode(data)
+
+    def finish(self, index):
+        """
+        Text of an incomplete character left at the end of a closed stream.
+        """
+        if self.is_truncated:
+            return u''
+        return self._streams[index].decoder.decode(b'', True)
+
+    def truncation_marker(self):
+        if not self.dropped:
+            return u''
+        return self.TRUNCATION_MARKER.format(self.dropped)
+
+    def summary(self, index):
+        """
+        The head and the tail of a stream, with the count of bytes between them.
+        """
+        stream = self._streams[index]
+        skipped = stream.size - len(stream.head) - len(stream.tail)
+        if not skipped:
+            return (stream.head + stream.tail).decode('utf-8', 'replace')
+        # characters cut by the head or the tail edge are left out
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        head = decoder.decode(bytes(stream.head))
+        skipped += len(decoder.getstate()[0])
+        start = 0
+        while start < len(stream.tail) and _is_continuation(stream.tail[start]):
+            start += 1
+        tail = bytes(stream.tail[start:]).decode('utf-8', 'replace')
+        return head + u'\n... {} bytes skipped ...\n'.format(skipped + start) + tail
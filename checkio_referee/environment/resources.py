@@ -0,0 +1,90 @@
+"""
+Resource usage of environment processes, read from /proc, and resource limits
+applied when they are spawned. Both work on Linux only, elsewhere usage is None
+and limits are ignored.
+"""
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__all__ = ["read_usage", "diff_usage", "combine_usage", "resource_limits"]
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def read_usage(pid):
+    """
+    CPU user and system seconds (with waited children) and peak RSS in bytes
+    of a process, or None if they can not be read.
+    """
+    try:
+        with open('/proc/{}/stat'.format(pid), 'rb') as stat_file:
+            stat = stat_file.read()
+        with open('/proc/{}/status'.format(pid), 'rb') as status_file:
+            status = status_file.read()
+    except (IOError, OSError):
+        return None
+
+    # fields after the command name, which is in parentheses and may contain spaces
+    fields = stat[stat.rindex(b')') + 2:].split()
+    utime, stime, cutime, cstime = (int(value) for value in fields[11:15])
+    max_rss = 0
+    for line in status.splitlines():
+        if line.startswith(b'VmHWM:'):
+            max_rss = int(line.split()[1]) * 1024
+            break
+    return {
+        'cpu_user': (utime + cutime) / CLOCK_TICKS,
+        'cpu_system': (stime + cstime) / CLOCK_TICKS,
+        'max_rss': max_rss
+    }
+
+
+def diff_usage(before, after):
+    """
+    Usage between two readings. Peak RSS is the peak of the process so far.
+    """
+    if before is None or after is None:
+        return None
+    return {
+        'cpu_user': round(after['cpu_user'] - before['cpu_user'], 3),
+        'cpu_system': round(after['cpu_system'] - before['cpu_system'], 3),
+        'max_rss': after['max_rss']
+    }
+
+
+def combine_usage(usages):
+    usages = [usage for usage in usages if usage is not None]
+    if not usages:
+        return None
+    return {
+        'cpu_user': round(sum(usage['cpu_user'] for usage in usages), 3),
+        'cpu_system': round(sum(usage['cpu_system'] for usage in usages), 3),
+        'max_rss': max(usage['max_rss'] for usage in usages)
+    }
+
+
+def resource_limits(cpu_time=None, address_space=None):
+    """
+    Returns a preexec_fn which sets RLIMIT_CPU (seconds) and RLIMIT_AS (bytes)
+    in a spawned process, or None if there is nothing to set.
+    """
+    limits = []
+    if resource is not None:
+        if cpu_time:
+            limits.append((resource.RLIMIT_CPU, int(cpu_time)))
+        if address_space:
+            limits.append((resource.RLIMIT_AS, int(address_space)))
+    if not limits:
+        return None
+
+    def set_limits():
+        for name, value in limits:
+            hard = resource.getrlimit(name)[1]
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(name, (value, value))
+    return set_limits
@@ -1,21 +1,49 @@
+import errno
 import logging
+import struct
 
 from tornado import gen
-from tornado.escape import json_encode, json_decode
+from tornado.escape import json_decode
 from tornado.iostream import StreamClosedError
+from tornado.netutil import bind_sockets
 from tornado.tcpserver import TCPServer
 
+from checkio_referee.exceptions import CheckioEnvironmentError
+from checkio_referee.environment.blobs import encode_message
+
 logger = logging.getLogger(__name__)
 
 
 class EnvironmentsTCPServer(TCPServer):
 
-    PORT = 8383
+    PORT = 8383  # 0 lets the system pick a free port
+    MAX_FRAME_SIZE = 64 * 1024 * 1024
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, max_frame_size=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.stream_handler = None
         self.connection_message_callback = None
+        self.max_frame_size = max_frame_size or self.MAX_FRAME_SIZE
+        self.port = None
+
+    def listen_free(self, ports, address=''):
+        """
+        Listen on the first port of ports which is not in use, port 0 is picked by the
+        system. The port is returned and kept in self.port to be passed to environments.
+        """
+        for port in ports:
+            try:
+                sockets = bind_sockets(port, address=address)
+            except OSError as e:
+                if e.errno != errno.EADDRINUSE:
+                    raise
+                logger.debug("[EXECUTOR-SERVER] :: port {} is in use".format(port))
+                continue
+            self.add_sockets(sockets)
+            self.port = sockets[0].getsockname()[1]
+            return self.port
+        raise CheckioEnvironmentError("No free port to listen for environments in {}".format(
+            ports))
 
     def handle_stream(self, stream, address):
         self.stream_handler = StreamHandler(stream, address, self)
@@ -25,13 +53,27 @@ class EnvironmentsTCPServer(TCPServer):
 
 
 class StreamHandler(object):
+    """
+    Messages are JSON terminated by a null byte. Environments which announce the
+    'framing' capability in the connection message switch to frames with a 4 bytes
+    big-endian length header, read into a reusable buffer and limited by
+    max_frame_size.
+    """
 
     terminator = b'\0'
+    frame_header = struct.Struct('>I')
+
+    CAPABILITY_FRAMING = 'framing'
+    # frame buffers bigger than this are not kept between messages
+    FRAME_BUFFER_KEEP_SIZE = 1024 * 1024
+    SKIP_CHUNK_SIZE = 64 * 1024
 
     def __init__(self, stream, address, server):
         self.stream = stream
         self.address = address
         self.server = server
+        self.is_framed = False
+        self._frame_buffer = bytearray()
         self._is_connection_closed = False
         self.stream.set_close_callback(self._on_client_connection_close)
         self._read_connection_message()
@@ -42,9 +84,15 @@ class StreamHandler(object):
         return json_decode(data.decode())
 
     def _data_encode(self, data):
-        data = json_encode(data)
+        data = encode_message(data)
         return data.encode('utf-8')
 
+    def closed(self):
+        return self._is_connection_closed
+
+    def close(self):
+        self.stream.close()
+
     def _on_client_connection_close(self):
         self._is_connection_closed = True
         logger.debug("[EXECUTOR-SERVER] :: CONNECTED {}".format(
@@ -54,17 +102,57 @@ class StreamHandler(object):
     @gen.coroutine
     def read_message(self):
         try:
+            if self.is_framed:
+                message = yield self._read_frame()
+                return message
             data = yield self.stream.read_until(self.terminator)
         except StreamClosedError:
             return
         logger.debug("[EXECUTOR-SERVER] :: FROM {}".format(data))
         return self._data_decode(data)
 
+    @gen.coroutine
+    def _read_frame(self):
+        header = yield self.stream.read_bytes(self.frame_header.size)
+        size = self.frame_header.unpack(header)[0]
+        if size > self.server.max_frame_size:
+            yield self._skip_bytes(size)
+            logger.error("[EXECUTOR-SERVER] :: FROM {} frame of {} bytes skipped".format(
+                self.address, size))
+            return {
+                'status': 'fail',
+                'description': 'Message size {} exceeds the limit of {} bytes'.format(
+                    size, self.server.max_frame_size)
+            }
+
+        if hasattr(self.stream, 'read_into'):
+            if len(self._frame_buffer) < size:
+                self._frame_buffer = bytearray(size)
+            data = memoryview(self._frame_buffer)[:size]
+            yield self.stream.read_into(data)
+        else:
+            data = memoryview((yield self.stream.read_bytes(size)))
+        logger.debug("[EXECUTOR-SERVER] :: FROM frame {} bytes".format(size))
+        try:
+            return json_decode(str(data, 'utf-8'))
+        finally:
+            data.release()
+            if len(self._frame_buffer) > self.FRAME_BUFFER_KEEP_SIZE:
+                self._frame_buffer = bytearray()
+
+    @gen.coroutine
+    def _skip_bytes(self, size):
+        while size > 0:
+            chunk_size = min(size, self.SKIP_CHUNK_SIZE)
+            yield self.stream.read_bytes(chunk_size)
+            size -= chunk_size
+
     def _read_connection_message(self):
         self.stream.read_until(self.terminator, self._on_connection_message)
 
     def _on_connection_message(self, data):
         data = self._data_decode(data)
+        self.is_framed = self.CAPABILITY_FRAMING in (data.get('capabilities') or ())
         self.server.connection_message_callback(data, self)
 
     @gen.coroutine
@@ -73,7 +161,11 @@ class StreamHandler(object):
             return
         message = self._data_encode(message)
         logger.debug("[EXECUTOR-SERVER] :: TO {}".format(message))
+        if self.is_framed:
+            message = self.frame_header.pack(len(message)) + message
+        else:
+            message += self.terminator
         try:
-            yield self.stream.write(message + self.terminator)
+            yield self.stream.write(message)
         except Exception as e:
             logger.error(e)
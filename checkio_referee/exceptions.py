@@ -23,6 +23,16 @@ class RefereeCodeRunFailed(RefereeExecuteFailed):
     pass
 
 
+class RefereeTimeout(RefereeExecuteFailed):
+    def __init__(self, phase, timeout, *args, **kwargs):
+        self.phase = phase
+        self.timeout = timeout
+        description = kwargs.pop('description', None) or "Timeout: {} took more than {} " \
+                                                          "seconds".format(phase, timeout)
+        super().__init__(*args, **kwargs)
+        self.description = description
+
+
 class CheckioEnvironmentError(Exception):
     pass
 
@@ -1,9 +1,14 @@
 import logging
 
 from tornado import gen
-from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.ioloop import IOLoop
 
 from checkio_referee import exceptions
+from checkio_referee.editor.output import OutputBuffer
+from checkio_referee.environment.resources import combine_usage
+from checkio_referee.handlers.settings import resolve_settings
+from checkio_referee.utils import metrics
+from checkio_referee.utils.deadlines import Deadline
 
 logger = logging.getLogger(__name__)
 
@@ -25,20 +30,20 @@ class BaseHandler(object):
 
         self.editor_client = editor_client
         self._referee = referee
+        # settings are plain instance attributes, so self.TESTS is a dict lookup. They
+        # are not read-only, a handler may change its own settings
+        for name, value in resolve_settings(type(self), referee).items():
+            if not hasattr(type(getattr(type(self), name, None)), '__set__'):
+                self.__dict__[name] = value
 
         self.environment = None
+        self._environments = set()
+        self._output_buffers = {}
         self._is_stopping = None
         self._stop_callback = None
-        self._back_check = PeriodicCallback(self.back_check, 500)
-        self._back_check.start()
-
-    def __getattribute__(self, attr):
-        referee_priority = object.__getattribute__(self, 'REFEREE_SETTINGS_PRIORITY')
-        if referee_priority is not None and attr in referee_priority:
-            referee_value = getattr(self._referee, attr, None)
-            if referee_value is not None:
-                return referee_value
-        return object.__getattribute__(self, attr)
+        self.timeout_error = None
+        self.resource_usage = None
+        self.metric_labels = {'handler': type(self).__name__, 'env_name': self.env_name}
 
     def __getattr__(self, attr):
         if attr == attr.upper():
@@ -51,10 +56,6 @@ class BaseHandler(object):
             else:
                 raise
 
-    @gen.coroutine
-    def back_check(self):
-        pass
-
     @gen.coroutine
     def start(self):
         raise NotImplementedError
@@ -66,8 +67,8 @@ class BaseHandler(object):
         if self._is_stopping is not None:
             return
         self._is_stopping = True
-        if self.environment is not None:
-            self.environment.stop()
+        self.flush_output()
+        self.stop_environments()
 
         if self._stop_callback is not None:
             self._stop_callback()
@@ -76,12 +77,79 @@ class BaseHandler(object):
     def get_environment(self, env_name):
         environment = yield self._referee.environments_controller.get_environment(
             env_name, on_stdout=self.on_stdout, on_stderr=self.on_stderr)
+        self._environments.add(environment)
         return environment
 
+    @gen.coroutine
+    def release_environment(self, environment):
+        self._environments.discard(environment)
+        yield self._referee.environments_controller.release_environment(environment)
+
+    @gen.coroutine
+    def stop_environments(self):
+        environments, self._environments = self._environments, set()
+        yield [environment.stop() for environment in environments]
+
+    def kill_environments(self):
+        """
+        Returns the resource usage of the killed environments.
+        """
+        environments, self._environments = self._environments, set()
+        return combine_usage([self._referee.environments_controller.kill_environment(environment)
+                              for environment in environments])
+
+    def timer(self, name):
+        return metrics.timer(name, **self.metric_labels)
+
+    def time_future(self, name, future):
+        started = metrics.now()
+        IOLoop.current().add_future(future, lambda _: metrics.observe(
+            name, metrics.now() - started, **self.metric_labels))
+        return future
+
+    def get_resource_usage(self, environment):
+        if not self.RESOURCE_USAGE:
+            return None
+        return self._referee.environments_controller.get_resource_usage(environment)
+
+    def add_resource_usage(self, usage):
+        if usage is not None:
+            self.resource_usage = combine_usage([self.resource_usage, usage])
+
+    def deadline(self, phase, timeout):
+        return Deadline(phase, timeout, self.on_deadline)
+
+    def on_deadline(self, deadline):
+        """
+        A phase took too long: environments are killed, so the waiting calls fail, and
+        the first expired phase is kept in timeout_error to be reported. With
+        RESOURCE_USAGE the CPU time of the killed environments shows whether the code
+        was busy or the host was starved.
+        """
+        logger.warning("Handler:: {} timed out after {} seconds".format(deadline.phase,
+                                                                       deadline.timeout))
+        metrics.inc('timeouts_total', phase=deadline.phase, **self.metric_labels)
+        usage = self.kill_environments()
+        if self.timeout_error is None:
+            additional_data = {'resource_usage': usage} if usage is not None else None
+            self.timeout_error = exceptions.RefereeTimeout(deadline.phase, deadline.timeout,
+                                                           additional_data=additional_data)
+
     def on_stdout(self, exec_name, line):
         logger.debug("STDOUT: " + line)
-        IOLoop.current().spawn_callback(self.editor_client.send_stdout, line)
+        self._get_output_buffer(exec_name).write(OutputBuffer.STDOUT, line)
 
     def on_stderr(self, exec_name, line):
         logger.debug("STDERR: " + line)
-        IOLoop.current().spawn_callback(self.editor_client.send_stderr, line)
+        self._get_output_buffer(exec_name).write(OutputBuffer.STDERR, line)
+
+    def _get_output_buffer(self, exec_name):
+        output_buffer = self._output_buffers.get(exec_name)
+        if output_buffer is None:
+            output_buffer = self._output_buffers[exec_name] = OutputBuffer(
+                self.editor_client, self.OUTPUT_FLUSH_SIZE, self.OUTPUT_FLUSH_INTERVAL)
+        return output_buffer
+
+    def flush_output(self):
+        for output_buffer in self._output_buffers.values():
+            output_buffer.flush()
@@ -1,40 +1,47 @@
 import logging
 
 from tornado import gen
+from tornado.concurrent import is_future
 from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
 
 from checkio_referee import exceptions
+from checkio_referee.environment.resources import diff_usage
 from checkio_referee.handlers.base import BaseHandler
-from checkio_referee.utils import validators
+from checkio_referee.utils import metrics, validators
+from checkio_referee.utils.history import test_key
+from checkio_referee.utils.previews import exceeds_size, preview
 from checkio_referee.utils.representations import base_representation
+from checkio_referee.utils.suites import compile_suite
+from checkio_referee.utils.verdicts import verdict_key
 from time import time
 
 logger = logging.getLogger(__name__)
 
 
 class RunHandler(BaseHandler):
-    _time_start = 0
+
     @gen.coroutine
     def start(self):
-        self.environment = yield self.get_environment(self.env_name)
         try:
-            if 'pleasekillme' in self.code:
-                raise ValueError('PleaseKillMe')
-            self._time_start = time()
-            yield self.environment.run_code(code=self.code, env_config=self.ENV_CONFIG)
-        except exceptions.EnvironmentRunFail:
-            pass
-        yield self.environment.stop()
+            self.environment = yield self.get_environment(self.env_name)
+        except exceptions.RefereeTimeout as e:
+            self.timeout_error = e
+        else:
+            try:
+                if 'pleasekillme' in self.code:
+                    raise ValueError('PleaseKillMe')
+                with self.deadline('run', self.RUN_TIMEOUT), self.timer('run_code_seconds'):
+                    yield self.environment.run_code(code=self.code, env_config=self.ENV_CONFIG)
+            except exceptions.EnvironmentRunFail:
+                pass
+            yield self.environment.stop()
+        self.flush_output()
+        if self.timeout_error is not None:
+            yield self.editor_client.send_stderr(self.timeout_error.description)
         yield self.editor_client.send_run_finish(code=self.code)
         self.stop()
 
-    @gen.coroutine
-    def back_check(self):
-        if self._time_start and time() - self._time_start > self.RUN_TIMEOUT:
-            yield self.environment.stop()
-            yield self.editor_client.send_run_finish(code=self.code)
-            self.stop()
-
 
 class RunInConsoleHandler(BaseHandler):
 
@@ -59,6 +66,40 @@ class RunInConsoleHandler(BaseHandler):
             yield self._continue_run_in_console()
 
 
+class CheckShard(object):
+    """
+    A slice of a category checked in its own environment in parallel mode. Test events
+    are kept until all previous shards sent theirs, so the editor gets them in order.
+    """
+
+    def __init__(self, category_name, tests, first_test_number, on_event):
+        self.category_name = category_name
+        self.tests = tests
+        self.first_test_number = first_test_number
+        self.environment = None
+        self.events = []
+        self.error = None
+        self.is_done = False
+        self.is_cancelled = False
+        self._on_event = on_event
+
+    def spawn_callback(self, callback, **kwargs):
+        self.events.append((callback, kwargs))
+        self._on_event()
+
+    def set_environment(self, environment):
+        self.environment = environment
+        if self.is_cancelled:
+            environment.stop()
+
+    def cancel(self):
+        if self.is_cancelled or self.is_done:
+            return
+        self.is_cancelled = True
+        if self.environment is not None:
+            self.environment.stop()
+
+
 class CheckHandler(BaseHandler):
     TESTS = None
 
@@ -70,6 +111,21 @@ class CheckHandler(BaseHandler):
 
     CALLED_REPRESENTATIONS = {}
 
+    # send tests to the environment in chunks of this size, 0 sends them one by one
+    TESTS_BATCH_SIZE = 0
+    # number of categories (or shards) checked at the same time, 0 checks them one by one
+    PARALLEL_CATEGORIES = 0
+    # in parallel mode split categories into shards of this many tests, 0 keeps them whole
+    CATEGORY_SHARD_SIZE = 0
+    # utils.verdicts cache instance, checks of the same code replay the stored verdict
+    VERDICT_CACHE = None
+    # send only the result of the check, without pre_test and post_test events
+    VERDICT_ONLY = False
+    # utils.history store, in VERDICT_ONLY mode tests which are likely to fail run first
+    TEST_STATS = None
+    # results longer than this (roughly, in JSON) are sent in post_test as previews
+    RESULT_PREVIEW_SIZE = None
+
     REFEREE_SETTINGS_PRIORITY = (
         'TESTS',
         'DEFAULT_FUNCTION_NAME',
@@ -77,107 +133,530 @@ class CheckHandler(BaseHandler):
         'ENV_COVERCODE',
         'VALIDATOR',
         'CALLED_REPRESENTATIONS',
+        'TESTS_BATCH_SIZE',
+        'PARALLEL_CATEGORIES',
+        'CATEGORY_SHARD_SIZE',
+        'VERDICT_CACHE',
+        'VERDICT_ONLY',
+        'TEST_STATS',
+        'RESULT_PREVIEW_SIZE',
     )
 
-    _time_start = 0
-    _time_one_test = 0
+    _verdict_events = None
+    _validators = None
+    _test_suite = None
+    _shards = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.__dict__.get('TESTS'):
+            compile_suite(cls.TESTS)
 
     @property
     def function_name(self):
         return self.FUNCTION_NAMES.get(self.env_name, self.DEFAULT_FUNCTION_NAME)
 
+    @property
+    def test_suite(self):
+        """
+        TESTS compiled with utils.suites, once per process.
+        """
+        if self._test_suite is None:
+            self._test_suite = compile_suite(self.TESTS)
+        return self._test_suite
+
     @gen.coroutine
     def start(self):
         logger.debug("CheckHandler:: Start checking")
         assert self.TESTS
 
-        for category_name, tests in sorted(self.TESTS.items()):
-            try:
-                yield self.check_category(self.code, category_name, tests)
-            except exceptions.RefereeExecuteFailed as e:
-                yield self.result_check_fail(points=e.points, additional_data=e.additional_data)
-                return
-            except Exception:
-                yield self.result_check_fail()
-                raise
+        if (yield self.replay_verdict()):
+            self.stop()
+            return
+
+        passed_categories, error = yield self.check_categories()
+        if isinstance(error, exceptions.RefereeExecuteFailed):
+            yield self.result_check_fail(points=error.points,
+                                         additional_data=error.additional_data)
+            self.store_verdict()
+            return
+        elif error is not None:
+            yield self.result_check_fail()
+            raise error
 
         yield self.result_check_success()
+        self.store_verdict()
         self.stop()
 
+    def is_verdict_cacheable(self):
+        """
+        Missions which use random seeds or other non-deterministic checks should
+        return False here.
+        """
+        return self.VERDICT_CACHE is not None
+
+    def get_verdict_key(self):
+        return verdict_key(self.code, self.env_name, self.test_suite.digest,
+                           self.ENV_COVERCODE, self.VALIDATOR, type(self),
+                           self.verdict_key_options())
+
+    def verdict_key_options(self):
+        """
+        Settings which change the stored events. Handlers which have their own
+        settings for points or events extend them.
+        """
+        representation = self.CALLED_REPRESENTATIONS.get(self.env_name, base_representation)
+        options = {
+            'verdict_only': self.VERDICT_ONLY,
+            'function_name': self.function_name,
+            'called_representation': '{}.{}'.format(representation.__module__,
+                                                    representation.__qualname__),
+        }
+        if self.RESULT_PREVIEW_SIZE:
+            # stored post_test events have the previews
+            options['result_preview_size'] = self.RESULT_PREVIEW_SIZE
+        return options
+
+    def invalidate_verdict(self):
+        if self.VERDICT_CACHE is not None:
+            self.VERDICT_CACHE.invalidate(self.get_verdict_key())
+
     @gen.coroutine
-    def check_category(self, code, category_name, tests, **kwargs):
+    def replay_verdict(self):
+        """
+        Send the cached verdict of this code to the editor. Returns False if there is
+        nothing to replay, in which case events of the check are recorded.
+        """
+        if not self.is_verdict_cacheable():
+            return False
+        events = self.VERDICT_CACHE.get(self.get_verdict_key())
+        if is_future(events):
+            events = yield events
+        if events is None:
+            self._verdict_events = []
+            return False
+
+        logger.debug("CheckHandler:: Replay cached verdict")
+        for method, data in events:
+            if method == 'pre_test':
+                yield self.editor_client.send_pre_test(data)
+            elif method == 'post_test':
+                yield self.editor_client.send_post_test(data)
+            else:
+                yield self.editor_client.send_check_result(code=self.code, **data)
+        return True
+
+    def _record_verdict_event(self, method, data):
+        """
+        resource_usage is not stored, it was measured for the run which is cached and
+        a replay does not run anything.
+        """
+        if self._verdict_events is None:
+            return
+        if 'resource_usage' in data:
+            data = dict((name, value) for name, value in data.items()
+                        if name != 'resource_usage')
+        additional_data = data.get('additional_data')
+        if isinstance(additional_data, dict) and 'resource_usage' in additional_data:
+            data = dict(data, additional_data=dict(
+                (name, value) for name, value in additional_data.items()
+                if name != 'resource_usage') or None)
+        self._verdict_events.append((method, data))
+
+    def store_verdict(self):
+        if self._verdict_events is not None:
+            self.VERDICT_CACHE.set(self.get_verdict_key(), self._verdict_events)
+            self._verdict_events = None
+
+    def skip_verdict(self):
+        """
+        The result depends on something else than the code (e.g. a timeout), do not store it.
+        """
+        self._verdict_events = None
+
+    @gen.coroutine
+    def check_categories(self):
+        """
+        Check categories in sorted order. Returns the names of passed categories and
+        the exception which stopped checking, or None.
+        """
+        with self.deadline('check', self.CHECK_TIMEOUT):
+            if self.PARALLEL_CATEGORIES:
+                passed_categories, error = yield self.check_categories_parallel()
+            else:
+                passed_categories, error = yield self.check_categories_serial()
+
+        if self.TEST_STATS is not None:
+            self.TEST_STATS.save()
+        # calls fail when a timed out environment is killed, the timeout is the reason
+        if error is not None and self.timeout_error is not None:
+            error = self.timeout_error
+        if isinstance(error, exceptions.RefereeTimeout):
+            self.skip_verdict()
+        return passed_categories, error
+
+    @gen.coroutine
+    def check_categories_serial(self):
+        passed_categories = []
+        for category in self.test_suite.categories:
+            try:
+                yield self.check_category(self.code, category.name, category.tests)
+            except Exception as e:
+                return passed_categories, e
+            passed_categories.append(category.name)
+        return passed_categories, None
+
+    @gen.coroutine
+    def check_categories_parallel(self):
+        """
+        Check up to PARALLEL_CATEGORIES shards at the same time, each in its own
+        environment. A failed shard cancels all the shards after it, while the earlier
+        ones keep running, so the reported failure is the same as in serial mode.
+        """
+        shards = []
+        flush = lambda: self._flush_shards_events(shards)
+        for category in self.test_suite.categories:
+            tests = category.tests
+            shard_size = self.CATEGORY_SHARD_SIZE or len(tests) or 1
+            for first_test_number in range(0, max(len(tests), 1), shard_size):
+                shards.append(CheckShard(category.name,
+                                         tests[first_test_number:first_test_number + shard_size],
+                                         first_test_number, flush))
+
+        semaphore = Semaphore(self.PARALLEL_CATEGORIES)
+        yield [self._check_shard(shard, shards, semaphore) for shard in shards]
+
+        # a category passed when all of its shards passed
+        passed_categories = []
+        for shard in shards:
+            if shard.error is not None:
+                if shard.category_name in passed_categories:
+                    passed_categories.remove(shard.category_name)
+                return passed_categories, shard.error
+            if shard.category_name not in passed_categories:
+                passed_categories.append(shard.category_name)
+        return passed_categories, None
+
+    @gen.coroutine
+    def _check_shard(self, shard, shards, semaphore):
+        with (yield semaphore.acquire()):
+            if shard.is_cancelled:
+                return
+            try:
+                yield self.check_category(self.code, shard.category_name, shard.tests,
+                                          shard=shard)
+            except Exception as e:
+                if not shard.is_cancelled:
+                    shard.error = e
+                    for next_shard in shards[shards.index(shard) + 1:]:
+                        next_shard.cancel()
+            finally:
+                shard.is_done = True
+                self._flush_shards_events(shards)
+
+    def _flush_shards_events(self, shards):
+        io_loop = IOLoop.current()
+        for shard in shards:
+            for callback, kwargs in shard.events:
+                io_loop.spawn_callback(callback, **kwargs)
+            shard.events = []
+            if not shard.is_done or shard.error is not None:
+                break
+
+    @gen.coroutine
+    def check_category(self, code, category_name, tests, shard=None, **kwargs):
         logger.debug("CHECK:: Start Category '{}' checking".format(category_name))
 
         environment = self.environment = yield self.get_environment(self.env_name)
-        yield environment.set_config(self.get_env_config())
+        first_test_number = 0
+        if shard is not None:
+            first_test_number = shard.first_test_number
+            if self._shards is None:
+                self._shards = {}
+            self._shards[environment] = shard
+            shard.set_environment(environment)
+        try:
+            yield self._check_category_tests(environment, code, category_name, tests,
+                                             first_test_number)
+        finally:
+            # a released environment can be checking the next shard already
+            if shard is not None and self._shards.get(environment) is shard:
+                del self._shards[environment]
+
+    @gen.coroutine
+    def _check_category_tests(self, environment, code, category_name, tests, first_test_number):
+        set_config = self.time_future('set_config_seconds',
+                                      environment.set_config(self.get_env_config()))
+        if not environment.is_pipelined:
+            yield set_config
 
-        self._time_start = time()
+        usage_before = self.get_resource_usage(environment)
         try:
-            yield environment.run_code(code=code, env_config=self.ENV_CONFIG)
+            with self.deadline('run_code', self.RUN_TIMEOUT), self.timer('run_code_seconds'):
+                yield environment.run_code(code=code, env_config=self.ENV_CONFIG)
         except exceptions.EnvironmentRunFail:
             raise exceptions.RefereeCodeRunFailed()
-        self._time_start = 0
+        self.add_resource_usage(diff_usage(usage_before, self.get_resource_usage(environment)))
+        yield set_config
 
-        for test_number, test in enumerate(tests):
-            self._time_one_test = time()
-            test_passed = yield self.check_test_item(environment, test, category_name, test_number)
-            self._time_one_test = 0
+        if self.TESTS_BATCH_SIZE:
+            failed_test_number = yield self.check_tests_batched(
+                environment, tests, category_name, first_test_number)
+        else:
+            failed_test_number = yield self.check_tests(
+                environment, tests, category_name, first_test_number)
 
-            if not test_passed:
-                yield environment.stop()
-                description = "Category: {0}. Test {1} Validate Failed".format(category_name,
-                                                                               test_number)
-                raise exceptions.RefereeTestFailed(description=description)
+        if failed_test_number is not None:
+            yield environment.stop()
+            description = "Category: {0}. Test {1} Validate Failed".format(category_name,
+                                                                           failed_test_number)
+            raise exceptions.RefereeTestFailed(description=description)
 
-        yield environment.stop()
+        yield self.release_environment(environment)
+
+    def schedule_tests(self, tests, first_test_number=0):
+        """
+        Returns (test_number, test) pairs in the order they should run. In VERDICT_ONLY
+        mode with TEST_STATS the tests expected to fail soonest go first, nobody sees
+        the order of test events then.
+        """
+        numbered_tests = list(enumerate(tests, first_test_number))
+        if not self.VERDICT_ONLY or self.TEST_STATS is None:
+            return numbered_tests
+
+        keys = dict((id(test), self.get_test_key(test)) for test in tests)
+        known_times = [self.TEST_STATS.mean_time(key) for key in keys.values()]
+        known_times = [mean_time for mean_time in known_times if mean_time is not None]
+        default_time = sum(known_times) / len(known_times) if known_times else 1.0
+        return sorted(numbered_tests,
+                      key=lambda item: -self.TEST_STATS.priority(keys[id(item[1])],
+                                                                 default_time))
+
+    def record_test_stats(self, test, test_passed, duration):
+        if self.TEST_STATS is not None:
+            self.TEST_STATS.record(self.get_test_key(test), test_passed, duration)
+
+    def get_test_key(self, test):
+        suite_test = self.test_suite.get(test)
+        return test_key(test) if suite_test is None else suite_test.key
 
     @gen.coroutine
-    def back_check(self):
-        if self._time_start and time() - self._time_start > self.RUN_TIMEOUT:
-            yield self.environment.stop()
-            yield self.result_check_fail()
-            self.stop()
+    def check_tests(self, environment, tests, category_name, first_test_number=0):
+        """
+        Run tests one by one. Returns the number of the first failed test or None.
+
+        When tests are reordered, a failure only skips the tests after it in the list,
+        the ones before it still run, so the reported failure does not depend on the order.
+        """
+        failed_test_number = failed_error = None
+        for test_number, test in self.schedule_tests(tests, first_test_number):
+            if failed_test_number is not None and test_number > failed_test_number:
+                continue
+            error = None
+            time_started = time()
+            try:
+                test_passed = yield self.check_test_item(environment, test, category_name,
+                                                         test_number)
+            except exceptions.RefereeTestFailed as e:
+                test_passed, error = False, e
+            self.record_test_stats(test, test_passed, time() - time_started)
 
-        if self._time_one_test and time() - self._time_one_test > self.ONE_TEST_TIMEOUT:
-            yield self.environment.stop()
-            yield self.result_check_fail()
-            self.stop()
+            if not test_passed:
+                failed_test_number, failed_error = test_number, error
+                if error is not None and environment.is_closed():
+                    break
+        if failed_error is not None:
+            raise failed_error
+        return failed_test_number
+
+    @gen.coroutine
+    def check_tests_batched(self, environment, tests, category_name, first_test_number=0):
+        """
+        Send tests in chunks of TESTS_BATCH_SIZE and validate results as they are streamed
+        back. Returns the number of the first failed test or None.
+        """
+        events = self.get_test_events(environment)
+        failed_test_number = failed_error = None
+        scheduled_tests = self.schedule_tests(tests, first_test_number)
+        while scheduled_tests:
+            chunk = scheduled_tests[:self.TESTS_BATCH_SIZE]
+            scheduled_tests = scheduled_tests[self.TESTS_BATCH_SIZE:]
+            yield environment.run_func_batch([{
+                'function_name': self.get_function_name(test),
+                'function_args': self.get_test_input(test)
+            } for _, test in chunk])
+            # calls of a batch run back to back, each is measured from the previous result
+            usage_before = self.get_resource_usage(environment)
+
+            # without test events the results of a chunk are validated together
+            read_tests = []
+            for position, (test_number, test) in enumerate(chunk):
+                error = result_func = None
+                time_started = time()
+                if not self.VERDICT_ONLY:
+                    events.spawn_callback(self.pre_test, test=test)
+                try:
+                    with self.deadline('test', self.ONE_TEST_TIMEOUT), self.timer(
+                            'run_func_seconds'):
+                        result_func = yield environment.read_batch_result()
+                except exceptions.EnvironmentRunFail:
+                    description = "Category: {0}. Test {1} Run failed".format(category_name,
+                                                                              test_number)
+                    error = exceptions.RefereeTestFailed(description=description)
+                usage_after = self.get_resource_usage(environment)
+                usage, usage_before = diff_usage(usage_before, usage_after), usage_after
+                self.add_resource_usage(usage)
+
+                if error is not None:
+                    # the rest of the batch is not run after a run failure
+                    scheduled_tests = chunk[position + 1:] + scheduled_tests
+                # results of the chunk after the failed test are read but not validated
+                if failed_test_number is not None and test_number > failed_test_number:
+                    pass
+                elif self.VERDICT_ONLY:
+                    read_tests.append((test_number, test, result_func, error,
+                                       time() - time_started))
+                else:
+                    test_passed = error is None and self.validate_test_result(
+                        test, result_func, category_name, test_number, events, usage)
+                    self.record_test_stats(test, test_passed, time() - time_started)
+                    if not test_passed:
+                        failed_test_number, failed_error = test_number, error
+                        if error is None and all(number > failed_test_number for number, _
+                                                 in chunk[position + 1:] + scheduled_tests):
+                            scheduled_tests = []
+                            break
+                if error is not None:
+                    break
+
+            if read_tests:
+                passed = iter(self.validate_test_results(
+                    [item[1] for item in read_tests if item[3] is None],
+                    [item[2] for item in read_tests if item[3] is None]))
+                for test_number, test, result_func, error, duration in read_tests:
+                    test_passed = error is None and next(passed)
+                    if failed_test_number is not None and test_number > failed_test_number:
+                        continue
+                    self.record_test_stats(test, test_passed, duration)
+                    if not test_passed:
+                        failed_test_number, failed_error = test_number, error
+
+            # the tests before a failure still run, as in check_tests, unless the
+            # environment is closed
+            if failed_test_number is not None and environment.is_closed():
+                scheduled_tests = []
+            scheduled_tests = [item for item in scheduled_tests
+                               if failed_test_number is None or item[0] < failed_test_number]
+
+        if failed_error is not None:
+            raise failed_error
+        return failed_test_number
 
     @gen.coroutine
     def check_test_item(self, environment, test, category_name, test_number):
-        io_loop = IOLoop.current()
-        io_loop.spawn_callback(self.pre_test, test=test)
+        events = self.get_test_events(environment)
+        if not self.VERDICT_ONLY:
+            events.spawn_callback(self.pre_test, test=test)
 
-        function_name = test.get("function_name") or self.function_name
-        params = test.get('input', None)
+        function_name = self.get_function_name(test)
+        params = self.get_test_input(test)
+        usage_before = self.get_resource_usage(environment)
         try:
-            result_func = yield environment.run_func(function_name=function_name, params=params)
+            with self.deadline('test', self.ONE_TEST_TIMEOUT), self.timer('run_func_seconds'):
+                result_func = yield environment.run_func(function_name=function_name,
+                                                         params=params)
         except exceptions.EnvironmentRunFail:
             description = "Category: {0}. Test {1} Run failed".format(category_name, test_number)
             raise exceptions.RefereeTestFailed(description=description)
-
+        usage = diff_usage(usage_before, self.get_resource_usage(environment))
+        self.add_resource_usage(usage)
+
+        return self.validate_test_result(test, result_func, category_name, test_number, events,
+                                         usage)
+
+    def get_test_events(self, environment):
+        """
+        Where test events of the environment are spawned: the shard it checks in
+        parallel mode, the IOLoop otherwise.
+        """
+        shard = self._shards.get(environment) if self._shards else None
+        return IOLoop.current() if shard is None else shard
+
+    def get_validator(self, test, category_name):
+        """
+        A REUSABLE validator is created once per category and switched to the test.
+        """
+        if not self.VALIDATOR.is_reusable():
+            return self.VALIDATOR(test)
+        if self._validators is None:
+            self._validators = {}
+        validator = self._validators.get(category_name)
+        if validator is None:
+            validator = self._validators[category_name] = self.VALIDATOR(test)
+        else:
+            validator.set_test(test)
+        return validator
+
+    def validate_test_results(self, tests, results_func):
+        """
+        Validate results of several tests at once with VALIDATOR.validate_many, there are
+        no test events for them. Returns test_passed of every test.
+        """
+        with self.timer('validator_seconds'):
+            validator_results = self.VALIDATOR.validate_many(
+                tests, [result_func.get("result") for result_func in results_func])
+        for validator_result in validator_results:
+            metrics.inc('tests_total', passed=bool(validator_result.test_passed),
+                        **self.metric_labels)
+        return [validator_result.test_passed for validator_result in validator_results]
+
+    def get_function_name(self, test):
+        return test.get("function_name") or self.function_name
+
+    def get_test_input(self, test):
+        """
+        Input to send to the environment, tests of the suite have it encoded already.
+        """
+        suite_test = self.test_suite.get(test)
+        return test.get('input', None) if suite_test is None else suite_test.input
+
+    def validate_test_result(self, test, result_func, category_name, test_number, events=None,
+                             resource_usage=None):
         run_result = result_func.get("result")
-        validator = self.VALIDATOR(test)
-        validator_result = validator.validate(run_result)
-
-        io_loop.spawn_callback(self.post_test, test=test, validator_result=validator_result,
-                               category_name=category_name, test_number=test_number,
-                               run_result=run_result)
+        with self.timer('validator_seconds'):
+            validator = self.get_validator(test, category_name)
+            validator_result = validator.validate(run_result)
+        metrics.inc('tests_total', passed=bool(validator_result.test_passed),
+                    **self.metric_labels)
+
+        if not self.VERDICT_ONLY:
+            kwargs = {'resource_usage': resource_usage} if resource_usage is not None else {}
+            events = events or IOLoop.current()
+            events.spawn_callback(self.post_test, test=test, validator_result=validator_result,
+                                  category_name=category_name, test_number=test_number,
+                                  run_result=run_result, **kwargs)
 
         return validator_result.test_passed
 
     @gen.coroutine
     def pre_test(self, test):
         representation = self.CALLED_REPRESENTATIONS.get(self.env_name, base_representation)
-        called_str = representation(test, self.function_name)
+        suite_test = self.test_suite.get(test)
+        if suite_test is None:
+            called_str = representation(test, self.function_name)
+        else:
+            called_str = suite_test.representation(representation, self.function_name)
         logger.debug("PRE_TEST:: Called: {}".format(called_str))
-        yield self.editor_client.send_pre_test({
+        data = {
             'representation': called_str,
             'in': test["input"]
-        })
+        }
+        self._record_verdict_event('pre_test', data)
+        yield self.editor_client.send_pre_test(data)
 
     @gen.coroutine
-    def post_test(self, test, validator_result, category_name, test_number, run_result):
+    def post_test(self, test, validator_result, category_name, test_number, run_result,
+                  resource_usage=None):
         logger.debug("POST_TEST:: Check result for category {0}, test {1}: {2}\n"
                      "VALIDATOR: {3}".format(
             category_name,
@@ -185,13 +664,33 @@ class CheckHandler(BaseHandler):
             validator_result.test_passed,
             validator_result.additional_data
         ))
-        yield self.editor_client.send_post_test({
+        self.flush_output()
+        data = {
             'actual_result': run_result,
             'expected_result': test.get('answer'),
             'test_passed': validator_result.test_passed,
             'additional_data': validator_result.additional_data,
             'explanation': test.get('explanation')
-        })
+        }
+        if resource_usage is not None:
+            data['resource_usage'] = resource_usage
+        if self.RESULT_PREVIEW_SIZE:
+            self.preview_results(data)
+        self._record_verdict_event('post_test', data)
+        yield self.editor_client.send_post_test(data)
+
+    def preview_results(self, data):
+        """
+        Replace results over RESULT_PREVIEW_SIZE with previews, the names of the
+        replaced ones are listed in truncated_results.
+        """
+        truncated_results = []
+        for name in ('actual_result', 'expected_result'):
+            if exceeds_size(data[name], self.RESULT_PREVIEW_SIZE):
+                data[name] = preview(data[name])
+                truncated_results.append(name)
+        if truncated_results:
+            data['truncated_results'] = truncated_results
 
     def get_env_config(self, random_seed=None):
         env_config = {
@@ -206,6 +705,16 @@ class CheckHandler(BaseHandler):
     @gen.coroutine
     def _result_check(self, success, points=None, additional_data=None):
         print('RESULT SEND')
+        self.flush_output()
+        metrics.inc('checks_total', success=bool(success), **self.metric_labels)
+        if self.resource_usage is not None:
+            additional_data = dict(additional_data or {})
+            additional_data.setdefault('resource_usage', self.resource_usage)
+        self._record_verdict_event('result', {
+            'success': success,
+            'points': points,
+            'additional_data': additional_data
+        })
         yield self.editor_client.send_check_result(
             success=success,
             code=self.code,
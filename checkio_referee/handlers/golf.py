@@ -20,6 +20,16 @@ class CodeGolfCheckHandler(CheckHandler):
                                  ('DEFAULT_MAX_CODE_LENGTH', 'MAX_CODE_LENGTHS',
                                   'BASE_POINTS', 'COMMENT_MARKS'))
 
+    def verdict_key_options(self):
+        options = super().verdict_key_options()
+        options.update({
+            'max_code_length': self.MAX_CODE_LENGTHS.get(self.env_name,
+                                                         self.DEFAULT_MAX_CODE_LENGTH),
+            'base_points': self.BASE_POINTS,
+            'comment_mark': self.COMMENT_MARKS.get(self.env_name),
+        })
+        return options
+
     @property
     def code_length(self):
         lines = self.code.replace("\r\n", "\n").split("\n")
@@ -14,25 +14,34 @@ class RankCheckHandler(CheckHandler):
 
     REFEREE_SETTINGS_PRIORITY = CheckHandler.REFEREE_SETTINGS_PRIORITY + ('CATEGORY_POINTS',)
 
+    def verdict_key_options(self):
+        options = super().verdict_key_options()
+        options['category_points'] = self.CATEGORY_POINTS
+        return options
+
     @gen.coroutine
     def start(self):
         logger.debug("RankCheckHandler:: Start checking")
         assert self.TESTS
 
-        points = 0
-        for category_name, tests in sorted(self.TESTS.items()):
-            try:
-                yield self.check_category(self.code, category_name, tests)
-            except exceptions.RefereeExecuteFailed as e:
-                if points:
-                    yield self.result_check_success(points=points)
-                else:
-                    yield self.result_check_fail(additional_data=e.additional_data)
-                return
-            except Exception:
-                yield self.result_check_fail()
-                raise
-            points += self.CATEGORY_POINTS.get(category_name, 0)
+        if (yield self.replay_verdict()):
+            self.stop()
+            return
+
+        passed_categories, error = yield self.check_categories()
+        points = sum(self.CATEGORY_POINTS.get(category_name, 0)
+                     for category_name in passed_categories)
+        if isinstance(error, exceptions.RefereeExecuteFailed):
+            if points:
+                yield self.result_check_success(points=points)
+            else:
+                yield self.result_check_fail(additional_data=error.additional_data)
+            self.store_verdict()
+            return
+        elif error is not None:
+            yield self.result_check_fail()
+            raise error
 
         yield self.result_check_success(points=points)
+        self.store_verdict()
         self.stop()
@@ -0,0 +1,46 @@
+"""
+Settings of a handler resolved once, when the handler is created. Names from
+REFEREE_SETTINGS_PRIORITY take the referee value unless it is None, other
+UPPERCASE names of the referee are used when the handler does not define them.
+The handler keeps them as plain instance attributes.
+"""
+__all__ = ["resolve_settings"]
+
+_NOT_SET = object()
+_referee_names_cache = {}
+
+
+def _referee_names(handler_cls, referee_cls):
+    """
+    UPPERCASE names of the referee class which the handler class does not define.
+    """
+    key = (handler_cls, referee_cls)
+    names = _referee_names_cache.get(key)
+    if names is None:
+        names = _referee_names_cache[key] = tuple(
+            name for name in dir(referee_cls)
+            if name == name.upper() and not name.startswith('_') and
+            not hasattr(handler_cls, name))
+    return names
+
+
+def resolve_settings(handler_cls, referee):
+    """
+    Values of the settings names with the same merge rules as a lookup on the handler.
+    """
+    values = {}
+    priority = handler_cls.REFEREE_SETTINGS_PRIORITY or ()
+    for name in priority:
+        value = getattr(referee, name, None)
+        if value is None:
+            value = getattr(handler_cls, name, _NOT_SET)
+        if value is not _NOT_SET:
+            values[name] = value
+    names = _referee_names(handler_cls, type(referee))
+    instance_names = [name for name in getattr(referee, '__dict__', ())
+                      if name == name.upper() and not name.startswith('_') and
+                      not hasattr(handler_cls, name)]
+    for name in names + tuple(instance_names):
+        if name not in values:
+            values[name] = getattr(referee, name)
+    return values
@@ -9,6 +9,9 @@ from tornado.ioloop import IOLoop
 from checkio_referee.handlers import common, golf, rank
 from checkio_referee.editor import EditorClient
 from checkio_referee.environment import EnvironmentsController
+from checkio_referee.environment.tcpserver import EnvironmentsTCPServer
+from checkio_referee.utils import metrics
+from checkio_referee.utils.suites import compile_suite
 
 logger = logging.getLogger(__name__)
 
@@ -36,23 +39,64 @@ class RefereeBase(object):
 
     RUN_TIMEOUT = 300
     ONE_TEST_TIMEOUT = 30
-
-    def __init__(self, server_host, server_port, user_connection_id, docker_id, io_loop=None):
+    CHECK_TIMEOUT = None  # whole check, None disables
+
+    OUTPUT_FLUSH_SIZE = 8192
+    OUTPUT_FLUSH_INTERVAL = 0.05
+
+    ENVIRONMENTS_POOL_SIZE = EnvironmentsController.POOL_SIZE
+    ENVIRONMENTS_POOL_MAX_IDLE = EnvironmentsController.POOL_MAX_IDLE
+    ENVIRONMENTS_POOL_MAX_USES = EnvironmentsController.POOL_MAX_USES
+    ENVIRONMENTS_MAX_FRAME_SIZE = EnvironmentsTCPServer.MAX_FRAME_SIZE
+    # port for environments to connect to, 0 picks a free one, so that many referees
+    # can run on a host. ENVIRONMENTS_PORT_RANGE (first, last) takes the first free port
+    ENVIRONMENTS_PORT = EnvironmentsTCPServer.PORT
+    ENVIRONMENTS_PORT_RANGE = None
+    # 'socketpair' hands environments a connected socket instead of a TCP connection
+    ENVIRONMENTS_TRANSPORT = EnvironmentsController.TRANSPORT
+    ENVIRONMENTS_OUTPUT_LIMIT = EnvironmentsController.OUTPUT_LIMIT
+    ENVIRONMENTS_CONNECT_TIMEOUT = EnvironmentsController.CONNECT_TIMEOUT
+    ENVIRONMENTS_CPU_LIMIT = EnvironmentsController.CPU_LIMIT
+    ENVIRONMENTS_MEMORY_LIMIT = EnvironmentsController.MEMORY_LIMIT
+
+    # report CPU time and peak memory of environments with tests and results
+    RESOURCE_USAGE = False
+
+    # local port of the Prometheus metrics endpoint, None disables it
+    METRICS_PORT = None
+    # JSON file the metrics are written to when the process exits
+    METRICS_FILE = None
+
+    def __init__(self, server_host, server_port, user_connection_id, docker_id, io_loop=None,
+                 editor_client=None, environments_controller=None):
         assert self.ENVIRONMENTS
         self.__user_connection_id = user_connection_id
         self.__docker_id = docker_id
         self.__io_loop = io_loop or IOLoop.current()
 
-        self.editor_client = EditorClient(server_host, server_port, user_connection_id, docker_id,
-                                          self.__io_loop)
+        if editor_client is None:
+            editor_client = EditorClient(server_host, server_port, user_connection_id, docker_id,
+                                         self.__io_loop)
+        self.editor_client = editor_client
+        if environments_controller is not None:
+            self._environments_controller = environments_controller
 
         self.editor_client.add_cancel_callback(self._stop_signal_receiver)
         self.editor_connected = None
         self._handler = None
+        self._stop_callback = None
+        self._is_stopped = False
+        self.setup_metrics()
 
         if io_loop is None:
             self.__io_loop.start()
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # TESTS of a mission are compiled once, not on every check
+        if cls.__dict__.get('TESTS'):
+            compile_suite(cls.TESTS)
+
     @classmethod
     def set_handler(cls, action, handler):
         if action not in cls.AVAILABLE_HANDLER_ACTIONS:
@@ -97,15 +141,51 @@ class RefereeBase(object):
         self._handler.add_stop_callback(_stop)
         yield self._handler.start()
 
+    @classmethod
+    def setup_metrics(cls):
+        if cls.METRICS_PORT:
+            metrics.serve(cls.METRICS_PORT)
+        if cls.METRICS_FILE:
+            metrics.dump_at_exit(cls.METRICS_FILE)
+
+    @classmethod
+    def create_environments_controller(cls):
+        return EnvironmentsController(
+            cls.ENVIRONMENTS,
+            pool_size=cls.ENVIRONMENTS_POOL_SIZE,
+            pool_max_idle=cls.ENVIRONMENTS_POOL_MAX_IDLE,
+            pool_max_uses=cls.ENVIRONMENTS_POOL_MAX_USES,
+            max_frame_size=cls.ENVIRONMENTS_MAX_FRAME_SIZE,
+            connect_timeout=cls.ENVIRONMENTS_CONNECT_TIMEOUT,
+            cpu_limit=cls.ENVIRONMENTS_CPU_LIMIT,
+            memory_limit=cls.ENVIRONMENTS_MEMORY_LIMIT,
+            port=cls.ENVIRONMENTS_PORT,
+            port_range=cls.ENVIRONMENTS_PORT_RANGE,
+            transport=cls.ENVIRONMENTS_TRANSPORT,
+            output_limit=cls.ENVIRONMENTS_OUTPUT_LIMIT)
+
     @property
     def environments_controller(self):
         if not hasattr(self, '_environments_controller'):
-            setattr(self, '_environments_controller', EnvironmentsController(self.ENVIRONMENTS))
+            setattr(self, '_environments_controller', self.create_environments_controller())
         return getattr(self, '_environments_controller')
 
+    def add_stop_callback(self, callback):
+        """
+        With a stop callback the referee only releases its handler on stop and leaves
+        the process running (used by RefereeSessionManager).
+        """
+        self._stop_callback = callback
+
     def stop(self):
+        if self._is_stopped:
+            return
+        self._is_stopped = True
         if self._handler is not None:
             self._handler.stop()
+        if self._stop_callback is not None:
+            self._stop_callback(self)
+            return
         print('KILLMYSELF')
         sys.exit()
 
@@ -0,0 +1,85 @@
+import logging
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from checkio_referee.editor import EditorMultiplexClient
+
+logger = logging.getLogger(__name__)
+
+
+class RefereeSessionManager(object):
+    """
+    Long-lived process serving many user connections. All sessions share one editor
+    connection and one EnvironmentsController, each of them gets its own referee.
+
+        RefereeSessionManager(MyReferee, host, port, docker_id)
+    """
+
+    def __init__(self, referee_cls, server_host, server_port, docker_id, io_loop=None):
+        self.referee_cls = referee_cls
+        self.__server_host = server_host
+        self.__server_port = server_port
+        self.__docker_id = docker_id
+        self.__io_loop = io_loop or IOLoop.current()
+
+        self.editor_client = EditorMultiplexClient(server_host, server_port, docker_id,
+                                                   self.__io_loop)
+        self.editor_client.add_session_callback(self._start_session_signal_receiver)
+        self.sessions = {}
+
+        if io_loop is None:
+            self.__io_loop.start()
+
+    @property
+    def environments_controller(self):
+        if not hasattr(self, '_environments_controller'):
+            setattr(self, '_environments_controller',
+                    self.referee_cls.create_environments_controller())
+        return getattr(self, '_environments_controller')
+
+    @gen.coroutine
+    def start(self):
+        yield self.editor_client.connect()
+        self.editor_client.set_close_callback(self.on_close_editor_connection)
+
+    def start_session(self, user_connection_id):
+        if user_connection_id in self.sessions:
+            raise Exception("Session {} is already started".format(user_connection_id))
+        session_client = self.editor_client.add_session(user_connection_id)
+        referee = self.referee_cls(self.__server_host, self.__server_port, user_connection_id,
+                                   self.__docker_id, io_loop=self.__io_loop,
+                                   editor_client=session_client,
+                                   environments_controller=self.environments_controller)
+        referee.add_stop_callback(self.finish_session)
+        self.sessions[user_connection_id] = referee
+        self.__io_loop.spawn_callback(referee.start)
+        return referee
+
+    def finish_session(self, referee):
+        user_connection_id = referee.editor_client.user_connection_id
+        logger.debug("RefereeSessionManager:: finish session {}".format(user_connection_id))
+        self.sessions.pop(user_connection_id, None)
+        self.editor_client.remove_session(user_connection_id)
+
+    def on_close_editor_connection(self):
+        """
+        Sessions of the closed connection are stopped and the manager connects again,
+        EditorClient.connect retries until the editor server is back.
+        """
+        logger.info("RefereeSessionManager:: editor connection closed, reconnecting")
+        for referee in list(self.sessions.values()):
+            referee.stop()
+        self.environments_controller.stop_all_environments()
+        self.__io_loop.spawn_callback(self.start)
+
+    def _start_session_signal_receiver(self, signal, data=None):
+        try:
+            user_connection_id = data[EditorMultiplexClient.ATTR_NAME_CONNECTION_ID]
+            if user_connection_id in self.sessions:
+                logger.warning("RefereeSessionManager:: session {} is already started".format(
+                    user_connection_id))
+                return
+            self.start_session(user_connection_id)
+        except Exception as e:
+            logger.error(e, exc_info=True)
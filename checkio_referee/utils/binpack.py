@@ -0,0 +1,230 @@
+"""
+MessagePack encoding for referee packets. The msgpack package is used when it is
+installed, otherwise the pure-Python implementation below.
+
+Integers which do not fit into 64 bits are stored as extension type 1 with their
+decimal representation.
+"""
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+__all__ = ["packb", "unpackb"]
+
+EXT_BIG_INT = 1
+
+_float = struct.Struct('>d')
+_struct_cache = {fmt: struct.Struct(fmt) for fmt in ('>B', '>H', '>I', '>Q', '>b', '>h', '>i', '>q')}
+
+
+def _pack_int(value, parts):
+    if 0 <= value < 0x80:
+        parts.append(bytes((value,)))
+    elif -0x20 <= value < 0:
+        parts.append(bytes((value & 0xff,)))
+    elif 0 <= value <= 0xff:
+        parts.append(b'\xcc' + bytes((value,)))
+    elif 0 <= value <= 0xffff:
+        parts.append(b'\xcd' + _struct_cache['>H'].pack(value))
+    elif 0 <= value <= 0xffffffff:
+        parts.append(b'\xce' + _struct_cache['>I'].pack(value))
+    elif 0 <= value <= 0xffffffffffffffff:
+        parts.append(b'\xcf' + _struct_cache['>Q'].pack(value))
+    elif -0x80 <= value < 0:
+        parts.append(b'\xd0' + _struct_cache['>b'].pack(value))
+    elif -0x8000 <= value < 0:
+        parts.append(b'\xd1' + _struct_cache['>h'].pack(value))
+    elif -0x80000000 <= value < 0:
+        parts.append(b'\xd2' + _struct_cache['>i'].pack(value))
+    elif -0x8000000000000000 <= value < 0:
+        parts.append(b'\xd3' + _struct_cache['>q'].pack(value))
+    else:
+        _pack_ext(EXT_BIG_INT, str(value).encode(), parts)
+
+
+def _pack_ext(code, data, parts):
+    length = len(data)
+    if length <= 0xff:
+        parts.append(b'\xc7' + bytes((length, code)))
+    elif length <= 0xffff:
+        parts.append(b'\xc8' + _struct_cache['>H'].pack(length) + bytes((code,)))
+    else:
+        parts.append(b'\xc9' + _struct_cache['>I'].pack(length) + bytes((code,)))
+    parts.append(data)
+
+
+def _pack_length(length, fix_code, fix_limit, code_16, code_32, parts):
+    if length < fix_limit:
+        parts.append(bytes((fix_code | length,)))
+    elif length <= 0xffff:
+        parts.append(code_16 + _struct_cache['>H'].pack(length))
+    else:
+        parts.append(code_32 + _struct_cache['>I'].pack(length))
+
+
+def _pack(value, parts):
+    if value is None:
+        parts.append(b'\xc0')
+    elif value is True:
+        parts.append(b'\xc3')
+    elif value is False:
+        parts.append(b'\xc2')
+    elif isinstance(value, int):
+        _pack_int(value, parts)
+    elif isinstance(value, float):
+        parts.append(b'\xcb' + _float.pack(value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        length = len(data)
+        if length < 32:
+            parts.append(bytes((0xa0 | length,)))
+        elif length <= 0xff:
+            parts.append(b'\xd9' + bytes((length,)))
+        else:
+            _pack_length(length, 0, 0, b'\xda', b'\xdb', parts)
+        parts.append(data)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        length = len(value)
+        if length <= 0xff:
+            parts.append(b'\xc4' + bytes((length,)))
+        else:
+            _pack_length(length, 0, 0, b'\xc5', b'\xc6', parts)
+        parts.append(bytes(value))
+    elif isinstance(value, (list, tuple)):
+        _pack_length(len(value), 0x90, 16, b'\xdc', b'\xdd', parts)
+        for item in value:
+            _pack(item, parts)
+    elif isinstance(value, dict):
+        _pack_length(len(value), 0x80, 16, b'\xde', b'\xdf', parts)
+        for key, item in value.items():
+            _pack(key, parts)
+            _pack(item, parts)
+    else:
+        raise TypeError("Can not pack object of type {}".format(type(value).__name__))
+
+
+class _Unpacker(object):
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.position = 0
+
+    def _take(self, length):
+        start = self.position
+        self.position += length
+        if self.position > len(self.data):
+            raise ValueError("Packed data is truncated")
+        return self.data[start:self.position]
+
+    def _unpack_struct(self, fmt, size):
+        return _struct_cache[fmt].unpack(self._take(size))[0]
+
+    def _ext(self, length):
+        code = self._take(1)[0]
+        data = self._take(length)
+        if code == EXT_BIG_INT:
+            return int(str(data, 'ascii'))
+        raise ValueError("Unknown extension type {}".format(code))
+
+    def _array(self, length):
+        return [self.unpack() for _ in range(length)]
+
+    def _map(self, length):
+        result = {}
+        for _ in range(length):
+            key = self.unpack()
+            result[key] = self.unpack()
+        return result
+
+    def unpack(self):
+        code = self._take(1)[0]
+        if code < 0x80:
+            return code
+        if code >= 0xe0:
+            return code - 0x100
+        if 0xa0 <= code <= 0xbf:
+            return str(self._take(code & 0x1f), 'utf-8')
+        if 0x90 <= code <= 0x9f:
+            return self._array(code & 0x0f)
+        if 0x80 <= code <= 0x8f:
+            return self._map(code & 0x0f)
+        if code == 0xc0:
+            return None
+        if code == 0xc2:
+            return False
+        if code == 0xc3:
+            return True
+        if code == 0xcb:
+            return _float.unpack(self._take(8))[0]
+        if code == 0xca:
+            return struct.unpack('>f', self._take(4))[0]
+        if code in _INTS:
+            fmt, size = _INTS[code]
+            return self._unpack_struct(fmt, size)
+        if code in _LENGTHS:
+            kind, fmt, size = _LENGTHS[code]
+            length = self._unpack_struct(fmt, size)
+            if kind == 'str':
+                return str(self._take(length), 'utf-8')
+            if kind == 'bin':
+                return bytes(self._take(length))
+            if kind == 'array':
+                return self._array(length)
+            if kind == 'map':
+                return self._map(length)
+            return self._ext(length)
+        raise ValueError("Unknown type code {:#x}".format(code))
+
+
+_INTS = {
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+
+_LENGTHS = {
+    0xd9: ('str', '>B', 1), 0xda: ('str', '>H', 2), 0xdb: ('str', '>I', 4),
+    0xc4: ('bin', '>B', 1), 0xc5: ('bin', '>H', 2), 0xc6: ('bin', '>I', 4),
+    0xdc: ('array', '>H', 2), 0xdd: ('array', '>I', 4),
+    0xde: ('map', '>H', 2), 0xdf: ('map', '>I', 4),
+    0xc7: ('ext', '>B', 1), 0xc8: ('ext', '>H', 2), 0xc9: ('ext', '>I', 4),
+}
+
+
+def _py_packb(value):
+    parts = []
+    _pack(value, parts)
+    return b''.join(parts)
+
+
+def _py_unpackb(data):
+    unpacker = _Unpacker(data)
+    value = unpacker.unpack()
+    if unpacker.position != len(unpacker.data):
+        raise ValueError("Extra data after packed object")
+    return value
+
+
+def _default(value):
+    if isinstance(value, int):
+        return msgpack.ExtType(EXT_BIG_INT, str(value).encode())
+    raise TypeError("Can not pack object of type {}".format(type(value).__name__))
+
+
+def _ext_hook(code, data):
+    if code == EXT_BIG_INT:
+        return int(data.decode('ascii'))
+    return msgpack.ExtType(code, data)
+
+
+if msgpack is not None:
+    def packb(value):
+        return msgpack.packb(value, use_bin_type=True, default=_default)
+
+    def unpackb(data):
+        return msgpack.unpackb(data, raw=False, ext_hook=_ext_hook, strict_map_key=False)
+else:
+    packb = _py_packb
+    unpackb = _py_unpackb
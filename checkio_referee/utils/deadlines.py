@@ -0,0 +1,46 @@
+"""
+Deadlines of handler phases scheduled on the IOLoop, instead of polling the time.
+"""
+from tornado.ioloop import IOLoop
+
+__all__ = ["Deadline"]
+
+
+class Deadline(object):
+    """
+    Calls on_expire(deadline) if the phase is not finished in timeout seconds.
+    A timeout of None or 0 disables the deadline. Used as a context manager
+    around the phase:
+
+        with Deadline('test', 30, on_expire):
+            result = yield environment.run_func(...)
+    """
+
+    def __init__(self, phase, timeout, on_expire):
+        self.phase = phase
+        self.timeout = timeout
+        self.is_expired = False
+        self._on_expire = on_expire
+        self._handle = None
+
+    def start(self):
+        if self.timeout and self._handle is None:
+            io_loop = IOLoop.current()
+            self._handle = io_loop.call_at(io_loop.time() + self.timeout, self._expire)
+        return self
+
+    def cancel(self):
+        if self._handle is not None:
+            IOLoop.current().remove_timeout(self._handle)
+            self._handle = None
+
+    def _expire(self):
+        self._handle = None
+        self.is_expired = True
+        self._on_expire(self)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cancel()
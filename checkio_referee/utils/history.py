@@ -0,0 +1,179 @@
+"""
+This library contains the store of test history for referee handlers.
+
+For every test it keeps the number of runs, the number of failures and the total
+runtime. Handlers use it to run the tests which are most likely to fail first.
+"""
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+__all__ = ["test_key", "TestStatsStore"]
+
+RUNS, FAILURES, TOTAL_TIME = range(3)
+
+
+def test_key(test) -> str:
+    """
+    Key of a test in the store: digest of its JSON representation.
+
+    :param test: test dict from TESTS
+    :return: hex digest
+    """
+    data = json.dumps(test, sort_keys=True, default=repr)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class TestStatsStore(object):
+    """
+    Stats of tests in a file of JSON lines {key: [runs, failures, total_time]},
+    which are summed up on load. Without a path the stats are kept in memory only.
+
+    Records of a process are appended to the file as one line under a lock (a
+    ".lock" file next to it), so referee processes sharing the file do not lose
+    each other's records. Appends are done by a background thread at most every
+    save_interval seconds, the rest are written at exit. The file is compacted to
+    one line after compact_lines lines.
+
+    Tests are passed as test dicts or as their test_key, e.g. from a compiled suite.
+    """
+
+    SAVE_INTERVAL = 10
+    COMPACT_LINES = 1000
+
+    def __init__(self, path=None, save_interval=None, compact_lines=None):
+        self.path = path
+        self.save_interval = self.SAVE_INTERVAL if save_interval is None else save_interval
+        self.compact_lines = self.COMPACT_LINES if compact_lines is None else compact_lines
+        self._stats = None
+        self._records = {}
+        self._saved = None
+        self._saving = None
+        self._executor = None
+        if path is not None:
+            atexit.register(self.flush)
+
+    def _load(self):
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path, 'rb') as stats_file:
+                return self._sum_lines(stats_file)[0]
+        except IOError:
+            return {}
+
+    @staticmethod
+    def _sum_lines(lines):
+        stats = {}
+        lines_count = 0
+        for line in lines:
+            try:
+                records = json.loads(line)
+            except ValueError:
+                # a line cut by a crash
+                continue
+            lines_count += 1
+            _add_records(stats, records)
+        return stats, lines_count
+
+    def get(self, test):
+        """
+        Returns [runs, failures, total_time] of the test.
+        """
+        if self._stats is None:
+            self._stats = self._load()
+        key = test if isinstance(test, str) else test_key(test)
+        stats = list(self._stats.get(key, (0, 0, 0)))
+        for index, value in enumerate(self._records.get(key, ())):
+            stats[index] += value
+        return stats
+
+    def record(self, test, test_passed, duration):
+        key = test if isinstance(test, str) else test_key(test)
+        records = self._records.setdefault(key, [0, 0, 0])
+        records[RUNS] += 1
+        records[FAILURES] += not test_passed
+        records[TOTAL_TIME] += duration
+
+    def failure_rate(self, test):
+        # tests without history are as likely to fail as to pass
+        stats = self.get(test)
+        return (stats[FAILURES] + 1) / (stats[RUNS] + 2)
+
+    def mean_time(self, test, default=None):
+        stats = self.get(test)
+        if not stats[RUNS]:
+            return default
+        return stats[TOTAL_TIME] / stats[RUNS]
+
+    def priority(self, test, default_time=1.0):
+        """
+        Failures expected per second of the test run. Running tests in order of
+        decreasing priority finds a failure in the shortest expected time.
+        """
+        return self.failure_rate(test) / max(self.mean_time(test, default_time), 1e-6)
+
+    def save(self):
+        """
+        Hand the records over to the background writer, does not block. Records are
+        kept until save_interval passed since the last write and the write is done.
+        """
+        if not self._records:
+            return
+        if self.path is None:
+            self._stats = self._stats or {}
+            _add_records(self._stats, self._records)
+            self._records = {}
+            return
+        if self._saving is not None and not self._saving.done():
+            return
+        if self._saved is not None and monotonic() - self._saved < self.save_interval:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(1)
+        records, self._records = self._records, {}
+        if self._stats is not None:
+            _add_records(self._stats, records)
+        self._saved = monotonic()
+        self._saving = self._executor.submit(self._append, records)
+
+    def flush(self):
+        """
+        Write all the records now, in the calling thread.
+        """
+        if self._saving is not None:
+            self._saving.result()
+        if self._records and self.path is not None:
+            records, self._records = self._records, {}
+            self._append(records)
+
+    def _append(self, records):
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with open(self.path, 'a+b') as stats_file:
+                line = json.dumps(records).encode('utf-8') + b'\n'
+                if stats_file.tell():
+                    stats_file.seek(-1, os.SEEK_END)
+                    if stats_file.read(1) != b'\n':
+                        # a file saved as one JSON object
+                        line = b'\n' + line
+                stats_file.write(line)
+                stats_file.flush()
+                stats_file.seek(0)
+                stats, lines_count = self._sum_lines(stats_file)
+            if lines_count > self.compact_lines:
+                tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+                with open(tmp_path, 'w', encoding='utf-8') as tmp_file:
+                    tmp_file.write(json.dumps(stats) + '\n')
+                os.replace(tmp_path, self.path)
+        # the file has the records of this process and of the others now
+        self._stats = stats
+
+
+def _add_records(stats, records):
+    for key, values in records.items():
+        stats[key] = [a + b for a, b in zip(stats.get(key, (0, 0, 0)), values)]
@@ -0,0 +1,197 @@
+"""
+This library contains timing metrics of the referee: histograms and counters with
+labels, exported in the Prometheus text format from a local HTTP endpoint or
+dumped as JSON to a file when the process exits.
+
+    with metrics.timer('run_func_seconds', handler='CheckHandler', env_name='python_3'):
+        result = yield environment.run_func(...)
+"""
+import atexit
+import json
+import logging
+import os
+from bisect import bisect_left
+from time import monotonic
+
+__all__ = ["Histogram", "MetricsRegistry", "registry", "observe", "inc", "timer", "serve",
+           "dump_at_exit"]
+
+logger = logging.getLogger(__name__)
+
+now = monotonic
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30,
+                   60)
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+class _Timer(object):
+    __slots__ = ('registry', 'name', 'labels', 'started')
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = now()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.registry.observe(self.name, now() - self.started, **self.labels)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sort_key(item):
+    # label values may be of different types, e.g. None and str
+    name, labels = item[0]
+    return name, repr(labels)
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in labels) + '}'
+
+
+class MetricsRegistry(object):
+    """
+    Histograms and counters by name and labels. Labels are keyword arguments,
+    e.g. handler and env_name.
+    """
+
+    def __init__(self, prefix='referee_', buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def timer(self, name, **labels):
+        return _Timer(self, name, labels)
+
+    def clear(self):
+        self._histograms.clear()
+        self._counters.clear()
+
+    def to_prometheus(self):
+        lines = []
+        names = set()
+        for (name, labels), histogram in sorted(self._histograms.items(), key=_sort_key):
+            full_name = self.prefix + name
+            if name not in names:
+                names.add(name)
+                lines.append('# TYPE {} histogram'.format(full_name))
+            bounds = [str(bound) for bound in histogram.buckets] + ['+Inf']
+            for bound, count in zip(bounds, histogram.cumulative_counts()):
+                lines.append('{}_bucket{} {}'.format(full_name,
+                                                     _format_labels(labels, (('le', bound),)),
+                                                     count))
+            lines.append('{}_sum{} {}'.format(full_name, _format_labels(labels), histogram.sum))
+            lines.append('{}_count{} {}'.format(full_name, _format_labels(labels),
+                                                histogram.count))
+
+        for (name, labels), value in sorted(self._counters.items(), key=_sort_key):
+            full_name = self.prefix + name
+            if name not in names:
+                names.add(name)
+                lines.append('# TYPE {} counter'.format(full_name))
+            lines.append('{}{} {}'.format(full_name, _format_labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self):
+        return {
+            'histograms': [{
+                'name': name,
+                'labels': dict(labels),
+                'buckets': list(histogram.buckets),
+                'counts': histogram.counts,
+                'sum': histogram.sum,
+                'count': histogram.count
+            } for (name, labels), histogram in sorted(self._histograms.items(), key=_sort_key)],
+            'counters': [{
+                'name': name,
+                'labels': dict(labels),
+                'value': value
+            } for (name, labels), value in sorted(self._counters.items(), key=_sort_key)]
+        }
+
+    def dump(self, path):
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as stats_file:
+            json.dump(self.to_dict(), stats_file)
+        os.replace(tmp_path, path)
+
+
+registry = MetricsRegistry()
+observe = registry.observe
+inc = registry.inc
+timer = registry.timer
+
+_servers = {}
+_dump_paths = set()
+
+
+def serve(port, address='127.0.0.1', metrics_registry=None):
+    """
+    Serve metrics in the Prometheus text format at http://<address>:<port>/metrics.
+    A port is served only once per process.
+    """
+    if port in _servers:
+        return _servers[port]
+    # tornado.web is only needed when the endpoint is enabled
+    from tornado import web
+
+    metrics_registry = metrics_registry or registry
+
+    class MetricsHandler(web.RequestHandler):
+        def get(self):
+            self.set_header('Content-Type', 'text/plain; version=0.0.4')
+            self.write(metrics_registry.to_prometheus())
+
+    server = _servers[port] = web.Application([('/metrics', MetricsHandler)]).listen(
+        port, address=address)
+    logger.info("Metrics are served at {}:{}".format(address, port))
+    return server
+
+
+def dump_at_exit(path, metrics_registry=None):
+    if path in _dump_paths:
+        return
+    _dump_paths.add(path)
+    atexit.register((metrics_registry or registry).dump, path)
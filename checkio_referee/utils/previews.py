@@ -0,0 +1,89 @@
+"""
+This library contains bounded previews of big values, which are sent to the editor
+instead of the whole values. A preview keeps the structure of the value: long
+lists and dicts are cut with a "... N more items" element and long strings with
+"... N more characters".
+"""
+
+__all__ = ["exceeds_size", "preview"]
+
+MORE_ITEMS = '... {} more items'
+MORE_CHARACTERS = '... {} more characters'
+
+PREVIEW_ITEMS = 100  # values in a preview on all the levels together
+PREVIEW_STRING = 200  # characters of a string in a preview
+FLOAT_SIZE = 20
+
+
+def exceeds_size(value, size):
+    """
+    Is the JSON encoding of the value (roughly) longer than size. Stops as soon as
+    it is, so big values are not walked to the end.
+    """
+    total = 0
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            total += 2
+            for key in item:
+                total += len(str(key)) + 3
+                if total > size:
+                    return True
+            items = item.values()
+        elif isinstance(item, (list, tuple)):
+            total += 2
+            items = item
+        else:
+            items = (item,)
+        for element in items:
+            element_type = type(element)
+            if element_type is str:
+                total += len(element) + 3
+            elif element_type is float:
+                # repr of a float is slow, most are not longer than this
+                total += FLOAT_SIZE
+            elif element_type is int:
+                total += len(str(element)) + 1
+            elif element is None or element_type is bool:
+                total += 5
+            elif isinstance(element, (list, tuple, dict)):
+                total += 1
+                stack.append(element)
+            else:
+                total += len(str(element)) + 1
+            if total > size:
+                return True
+    return False
+
+
+def preview(value, max_items=PREVIEW_ITEMS, max_string=PREVIEW_STRING):
+    return _preview(value, [max_items], max_string)
+
+
+def _preview(value, budget, max_string):
+    if isinstance(value, str):
+        if len(value) > max_string:
+            return value[:max_string] + MORE_CHARACTERS.format(len(value) - max_string)
+        return value
+    if isinstance(value, (list, tuple)):
+        items = []
+        for item in value:
+            if budget[0] <= 0:
+                break
+            budget[0] -= 1
+            items.append(_preview(item, budget, max_string))
+        if len(items) < len(value):
+            items.append(MORE_ITEMS.format(len(value) - len(items)))
+        return items
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            if budget[0] <= 0:
+                break
+            budget[0] -= 1
+            items[key] = _preview(item, budget, max_string)
+        if len(items) < len(value):
+            items['...'] = MORE_ITEMS.format(len(value) - len(items))
+        return items
+    return value
@@ -1,9 +1,24 @@
 """
 This library contains various predefined called code representations for referee.
+
+Representations are bounded by max_length (MAX_LENGTH by default): long inputs are
+cut while they are written, e.g. "checkio([1, 2, 3, ... 99997 more])", the full
+string is never built. Results are memoized per test, so the tests of a mission
+are represented once per process.
 """
+from collections import OrderedDict
+from functools import wraps
 
 __all__ = ["base_representation", "unwrap_arg_representation", "py_tuple_representation"]
 
+MAX_LENGTH = 1000
+# cached results keep their tests alive, generated tests are dropped from the end
+CACHE_SIZE = 1000
+# containers nested deeper are written as "..."
+MAX_DEPTH = 100
+
+_cache = OrderedDict()
+
 
 def ext_str(data) -> str:
     """
@@ -15,14 +30,146 @@ def ext_str(data) -> str:
     return '"{}"'.format(data) if isinstance(data, str) else str(data)
 
 
-def base_representation(test, function_name):
-    return "{}({})".format(function_name, ext_str(test["input"]))
+class _BoundedWriter(object):
+    __slots__ = ('parts', 'length', 'max_length')
+
+    def __init__(self, max_length):
+        self.parts = []
+        self.length = 0
+        self.max_length = max_length
+
+    @property
+    def is_full(self):
+        return self.length >= self.max_length
+
+    def write(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+
+    def write_cut(self, text, quote=''):
+        """
+        Write the text or its beginning which fits, with "..." before the closing quote.
+        """
+        room = max(self.max_length - self.length, 0)
+        if len(text) > room + 3:
+            text = text[:room + len(quote)] + '...' + quote
+        self.write(text)
+
+    def write_repr(self, value, depth=0):
+        """
+        Write what str() of a container or repr() of a value would give.
+        """
+        if isinstance(value, str):
+            room = max(self.max_length - self.length, 0)
+            if len(value) > room:
+                text = repr(value[:room])
+                self.write(text[:-1] + '...' + text[-1])
+            else:
+                self.write(repr(value))
+        elif isinstance(value, (list, tuple, dict)):
+            if depth >= MAX_DEPTH:
+                self.write('...')
+            elif isinstance(value, dict):
+                self._write_items(value.items(), len(value), '{', '}', depth, is_dict=True)
+            elif isinstance(value, tuple):
+                self._write_items(value, len(value), '(', ',)' if len(value) == 1 else ')',
+                                  depth)
+            else:
+                self._write_items(value, len(value), '[', ']', depth)
+        else:
+            try:
+                text = repr(value)
+            except ValueError:
+                # ints too long to convert
+                text = '{}...'.format(type(value).__name__)
+            self.write_cut(text)
+
+    def _write_items(self, items, size, opening, closing, depth, is_dict=False):
+        parts = self.parts
+        parts.append(opening)
+        self.length += len(opening)
+        for number, item in enumerate(items):
+            if number:
+                parts.append(', ')
+                self.length += 2
+            if self.length >= self.max_length:
+                self.write('... {} more'.format(size - number))
+                break
+            if is_dict:
+                self.write_repr(item[0], depth + 1)
+                self.write(': ')
+                item = item[1]
+            item_type = type(item)
+            if (item_type is float or item is None or item_type is bool or
+                    item_type is int and item.bit_length() < 64):
+                # short enough to be written whole, most items are numbers
+                text = repr(item)
+                parts.append(text)
+                self.length += len(text)
+            else:
+                self.write_repr(item, depth + 1)
+        parts.append(closing)
+        self.length += len(closing)
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+def bounded_str(data, max_length=None):
+    """
+    ext_str cut to about max_length characters.
+    """
+    writer = _BoundedWriter(MAX_LENGTH if max_length is None else max_length)
+    if isinstance(data, str):
+        writer.write_cut('"{}"'.format(data) if len(data) <= writer.max_length
+                         else '"{}"'.format(data[:writer.max_length + 4]), '"')
+    else:
+        writer.write_repr(data)
+    return writer.getvalue()
+
+
+def memoized(representation):
+    """
+    Cache results by test, function name and max_length. The test is kept with its
+    result, so its id is not reused while it is cached.
+    """
+    @wraps(representation)
+    def wrapper(test, function_name, max_length=None):
+        key = (representation, id(test), function_name, max_length)
+        cached = _cache.get(key)
+        if cached is not None and cached[0] is test:
+            _cache.move_to_end(key)
+            return cached[1]
+        result = representation(test, function_name, max_length)
+        _cache[key] = (test, result)
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+        return result
+    return wrapper
+
+
+@memoized
+def base_representation(test, function_name, max_length=None):
+    return "{}({})".format(function_name, bounded_str(test["input"], max_length))
 
 
-def unwrap_arg_representation(test, function_name):
-    arguments = ", ".join(ext_str(d) for d in test["input"])
-    return "{}({})".format(function_name, arguments)
+@memoized
+def unwrap_arg_representation(test, function_name, max_length=None):
+    writer = _BoundedWriter(MAX_LENGTH if max_length is None else max_length)
+    arguments = test["input"]
+    for number, argument in enumerate(arguments):
+        if number:
+            writer.write(', ')
+        if writer.is_full:
+            writer.write('... {} more'.format(len(arguments) - number))
+            break
+        if isinstance(argument, str):
+            writer.write_cut('"{}"'.format(argument[:writer.max_length + 4]), '"')
+        else:
+            writer.write_repr(argument)
+    return "{}({})".format(function_name, writer.getvalue())
 
 
-def py_tuple_representation(test, function_name):
-    return "{}({})".format(function_name, tuple(test["input"]))
+@memoized
+def py_tuple_representation(test, function_name, max_length=None):
+    return "{}({})".format(function_name, bounded_str(tuple(test["input"]), max_length))
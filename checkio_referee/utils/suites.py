@@ -0,0 +1,150 @@
+"""
+This library contains test suites: TESTS of a mission compiled once into read-only
+objects, which checks use instead of walking the TESTS dict again.
+
+A suite has the categories in the order they are checked, inputs encoded to JSON
+once (identical inputs share one encoding and one blob digest), the TEST_STATS key
+of every test and digests of the categories and of the whole suite.
+Representations are computed on the first use and kept with the test.
+
+Suites are compiled when a referee or a handler class with TESTS is created and
+cached by the TESTS object, so TESTS should not be changed in place after that.
+"""
+import hashlib
+from collections import OrderedDict
+
+from tornado.escape import json_encode
+
+from checkio_referee.environment.blobs import EncodedValue
+from checkio_referee.utils.history import test_key
+
+__all__ = ["SuiteTest", "SuiteCategory", "TestSuite", "compile_suite"]
+
+# suites keep their TESTS, the ones of generated TESTS are dropped from the end
+CACHE_SIZE = 16
+# shorter inputs are encoded with the message again, it is as fast as inserting them
+ENCODED_MIN_SIZE = 256
+
+_suites = OrderedDict()
+
+
+class _ReadOnly(object):
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is read-only".format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("{} is read-only".format(type(self).__name__))
+
+
+class SuiteTest(_ReadOnly):
+    """
+    A test dict from TESTS with its input encoded. input is an EncodedValue, or the
+    raw input if it is short or not JSON serializable.
+    """
+    __slots__ = ('test', 'input', 'function_name', 'key', '_representations')
+
+    def __init__(self, test, encoded_input, key):
+        object.__setattr__(self, 'test', test)
+        object.__setattr__(self, 'input', encoded_input)
+        object.__setattr__(self, 'function_name', test.get('function_name'))
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, '_representations', {})
+
+    def representation(self, representation, function_name):
+        key = (representation, function_name)
+        called_str = self._representations.get(key)
+        if called_str is None:
+            called_str = self._representations[key] = representation(self.test, function_name)
+        return called_str
+
+
+class SuiteCategory(_ReadOnly):
+    """
+    tests is a tuple of the test dicts, digest covers their content.
+    """
+    __slots__ = ('name', 'tests', 'digest')
+
+    def __init__(self, name, tests, keys):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'tests', tuple(tests))
+        object.__setattr__(self, 'digest', hashlib.sha256(
+            '\n'.join(keys).encode('utf-8')).hexdigest())
+
+    def __len__(self):
+        return len(self.tests)
+
+    def __iter__(self):
+        return iter(self.tests)
+
+
+class TestSuite(_ReadOnly):
+    """
+    Categories sorted by name. Tests are looked up by their dicts, so handlers and
+    validators keep working with the dicts from TESTS.
+    """
+    __slots__ = ('tests', 'categories', 'digest', 'unique_inputs', '_items')
+
+    def __init__(self, tests):
+        object.__setattr__(self, 'tests', tests)
+        items = {}
+        inputs = {}
+        categories = []
+        for category_name, category_tests in sorted(tests.items()):
+            keys = []
+            for test in category_tests:
+                item = items.get(id(test))
+                if item is None:
+                    item = items[id(test)] = SuiteTest(test, self._encode(test.get('input'),
+                                                                          inputs),
+                                                       test_key(test))
+                keys.append(item.key)
+            categories.append(SuiteCategory(category_name, category_tests, keys))
+
+        object.__setattr__(self, 'categories', tuple(categories))
+        object.__setattr__(self, 'digest', hashlib.sha256('\n'.join(
+            '{} {}'.format(json_encode(category.name), category.digest)
+            for category in categories).encode('utf-8')).hexdigest())
+        object.__setattr__(self, 'unique_inputs', len(inputs))
+        object.__setattr__(self, '_items', items)
+
+    @staticmethod
+    def _encode(value, inputs):
+        try:
+            encoded = json_encode(value)
+        except TypeError:
+            return value
+        if len(encoded) < ENCODED_MIN_SIZE:
+            return inputs.setdefault(encoded, value)
+        encoded_value = inputs.get(encoded)
+        if encoded_value is None:
+            encoded_value = inputs[encoded] = EncodedValue(value, encoded)
+        return encoded_value
+
+    def __iter__(self):
+        return iter(self.categories)
+
+    def __len__(self):
+        return sum(len(category) for category in self.categories)
+
+    def get(self, test):
+        """
+        SuiteTest of a test dict, None for tests which are not in the suite.
+        """
+        # the suite keeps its test dicts, so their ids are not reused
+        return self._items.get(id(test))
+
+
+def compile_suite(tests):
+    """
+    TestSuite of TESTS, compiled on the first call for the TESTS object.
+    """
+    suite = _suites.get(id(tests))
+    if suite is not None and suite.tests is tests:
+        _suites.move_to_end(id(tests))
+        return suite
+    suite = _suites[id(tests)] = TestSuite(tests)
+    if len(_suites) > CACHE_SIZE:
+        _suites.popitem(last=False)
+    return suite
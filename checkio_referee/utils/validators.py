@@ -1,8 +1,16 @@
 """
 This library contains various predefined comparing and checking classes for referee class.
 """
+from itertools import islice
 from random import choice
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from checkio_referee.utils.previews import preview
+
 
 class ValidatorResult(object):
     def __init__(self, test_passed, additional_data=None):
@@ -11,29 +19,235 @@ class ValidatorResult(object):
 
 
 class BaseValidator(object):
+    # an instance is reused for the tests of a category, set_test switches the test.
+    # Not inherited: a subclass may keep state of a test, it sets REUSABLE itself
+    REUSABLE = False
+
     def __init__(self, test_data):
         self._test = test_data
         self.additional_data = None
 
+    def set_test(self, test_data):
+        self._test = test_data
+        self.additional_data = None
+
     def validate(self, outer_result):
         raise NotImplementedError
 
+    @classmethod
+    def is_reusable(cls):
+        return cls.__dict__.get('REUSABLE', False)
+
+    @classmethod
+    def validate_many(cls, tests, outer_results):
+        """
+        ValidatorResult of every test and its result, in the same order.
+        """
+        results = []
+        validator = None
+        reusable = cls.is_reusable()
+        for test, outer_result in zip(tests, outer_results):
+            if validator is None or not reusable:
+                validator = cls(test)
+            else:
+                validator.set_test(test)
+            results.append(validator.validate(outer_result))
+        return results
+
 
 class EqualValidator(BaseValidator):
+    REUSABLE = True
+
     def validate(self, outer_result):
         return ValidatorResult(self._test.get("answer", None) == outer_result)
 
+    @classmethod
+    def validate_many(cls, tests, outer_results):
+        if cls.validate is not EqualValidator.validate:
+            return super().validate_many(tests, outer_results)
+        # == on nested lists already runs in C, converting them to arrays is slower
+        return [ValidatorResult(test.get("answer", None) == outer_result)
+                for test, outer_result in zip(tests, outer_results)]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float))
+
+
+def _estimated_size(value):
+    # sizes along the first items, exact for vectors and matrices
+    size = 1
+    while isinstance(value, (list, tuple)) and value:
+        size *= len(value)
+        value = value[0]
+    return size
+
+
+def _max_diff(answer, outer_result):
+    """
+    The biggest difference between numbers of nested lists, None if the shapes or
+    the types do not match.
+    """
+    if not isinstance(answer, (list, tuple)):
+        if not _is_number(outer_result):
+            return None
+        return abs(answer - outer_result)
+    if not isinstance(outer_result, (list, tuple)) or len(answer) != len(outer_result):
+        return None
+    worst = 0
+    for answer_item, result_item in zip(answer, outer_result):
+        if isinstance(answer_item, (list, tuple)):
+            diff = _max_diff(answer_item, result_item)
+            if diff is None:
+                return None
+        elif isinstance(result_item, (int, float)):
+            diff = abs(answer_item - result_item)
+        else:
+            return None
+        if diff > worst:
+            worst = diff
+        elif diff != diff:
+            # NaN
+            return diff
+    return worst
+
+
+def _numpy_max_diff(answer, outer_result):
+    try:
+        answer_array = numpy.asarray(answer, dtype=float)
+        result_array = numpy.asarray(outer_result)
+    except (TypeError, ValueError, OverflowError):
+        # OverflowError for ints out of the float range
+        return None
+    # strings and ragged lists are not converted to numbers
+    if result_array.dtype.kind not in 'biuf' or result_array.shape != answer_array.shape:
+        return None
+    if not answer_array.size:
+        return 0
+    return float(numpy.max(numpy.abs(answer_array - result_array)))
+
 
 class FloatEqualValidator(BaseValidator):
+    """
+    Answers are numbers or nested lists of numbers (vectors, matrices), the result
+    passes if every number is within 0.1 ** PRECISION of the answer.
+    """
     PRECISION = 3
+    REUSABLE = True
+    # nested answers with this many numbers are compared by NumPy when it is installed
+    NUMPY_MIN_SIZE = 64
 
     def validate(self, outer_result):
-        if not isinstance(outer_result, (int, float)):
+        answer = self._test.get("answer", 0)
+        if isinstance(answer, (list, tuple)):
+            return self.validate_nested(answer, outer_result)
+        if not _is_number(outer_result):
             return ValidatorResult(False, "The result should be a float or integer.")
-        diff = abs(self._test.get("answer", 0) - outer_result)
+        diff = abs(answer - outer_result)
+        return ValidatorResult(diff <= 0.1 ** self.PRECISION, diff)
+
+    def validate_nested(self, answer, outer_result):
+        diff = None
+        if numpy is not None and _estimated_size(answer) >= self.NUMPY_MIN_SIZE:
+            diff = _numpy_max_diff(answer, outer_result)
+        if diff is None:
+            diff = _max_diff(answer, outer_result)
+        if diff is None:
+            return ValidatorResult(False, "The result should be a list of the same shape "
+                                          "with floats or integers.")
         return ValidatorResult(diff <= 0.1 ** self.PRECISION, diff)
 
 
+def _path_key(key):
+    return '[{}]'.format('"{}"'.format(key) if isinstance(key, str) else key)
+
+
+def _first_difference(expected, actual, start, stop):
+    # the slices [start:stop] differ, halves are compared by == until one item is left
+    while stop - start > 1:
+        middle = (start + stop) // 2
+        if expected[start:middle] != actual[start:middle]:
+            stop = middle
+        else:
+            start = middle
+    return start
+
+
+def _list_items(path, expected, actual):
+    start, stop = 0, min(len(expected), len(actual))
+    while start < stop and expected[start:stop] != actual[start:stop]:
+        index = _first_difference(expected, actual, start, stop)
+        yield path + _path_key(index), expected[index], actual[index]
+        start = index + 1
+
+
+def _dict_items(path, expected, actual):
+    for key, expected_item in expected.items():
+        if key in actual:
+            yield path + _path_key(key), expected_item, actual[key]
+
+
+def structural_diff(answer, outer_result):
+    """
+    Yields differences between the answer and the result in the order of the answer:
+    (path, kind, expected, actual), where kind is 'value', 'length', 'missing' or
+    'extra'. Missing and extra keys of a dict come before the differences inside it.
+    The walk is lazy and iterative, equal parts are compared by ==, so the position
+    of a difference in a long list is found by bisection.
+    """
+    stack = [iter((('', answer, outer_result),))]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+            continue
+        path, expected, actual = item
+        if expected == actual:
+            continue
+        if isinstance(expected, list) and isinstance(actual, list):
+            if len(expected) != len(actual):
+                yield path, 'length', len(expected), len(actual)
+            stack.append(_list_items(path, expected, actual))
+        elif isinstance(expected, dict) and isinstance(actual, dict):
+            for key in expected:
+                if key not in actual:
+                    yield path + _path_key(key), 'missing', expected[key], None
+            for key in actual:
+                if key not in expected:
+                    yield path + _path_key(key), 'extra', None, actual[key]
+            stack.append(_dict_items(path, expected, actual))
+        else:
+            yield path, 'value', expected, actual
+
+
+class StructuralEqualValidator(BaseValidator):
+    """
+    Passes the same results as EqualValidator. For a failed result additional_data
+    has the first MAX_DIFFS differences with the path to them ('' is the whole
+    result, then [index] and ["key"]) and previews of the expected and the actual
+    values, so the user sees where a big result goes wrong.
+    """
+    REUSABLE = True
+    MAX_DIFFS = 1
+    PREVIEW_ITEMS = 10
+    PREVIEW_STRING = 50
+
+    def validate(self, outer_result):
+        answer = self._test.get("answer", None)
+        if answer == outer_result:
+            return ValidatorResult(True)
+        diffs = []
+        for path, kind, expected, actual in islice(structural_diff(answer, outer_result),
+                                                   self.MAX_DIFFS):
+            diff = {'path': path, 'kind': kind}
+            if kind != 'extra':
+                diff['expected'] = preview(expected, self.PREVIEW_ITEMS, self.PREVIEW_STRING)
+            if kind != 'missing':
+                diff['actual'] = preview(actual, self.PREVIEW_ITEMS, self.PREVIEW_STRING)
+            diffs.append(diff)
+        return ValidatorResult(False, {'diffs': diffs})
+
+
 class ExampleValidator(BaseValidator):
     def validate(self, outer_result):
         return ValidatorResult(choice((True, False)),
@@ -0,0 +1,144 @@
+"""
+This library contains caches of check verdicts for referee handlers.
+
+A verdict is the list of (method, data) events a check sent to the editor:
+"pre_test", "post_test" and the final "result". Resubmitted code gets the same
+events replayed without starting an environment.
+
+get() returns the events or None, caches which read them in the background return
+a Future of that instead.
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["verdict_key", "BaseVerdictCache", "MemoryVerdictCache", "FileVerdictCache"]
+
+
+def _qualified_name(cls):
+    return "{}.{}".format(cls.__module__, cls.__qualname__)
+
+
+def verdict_key(code, env_name, tests, covercode, validator, handler_cls, options=None) -> str:
+    """
+    Key of a verdict: digest of everything which defines the result of a check.
+
+    :param code: user code
+    :param env_name: environment name
+    :param tests: TESTS of the mission or the digest of its compiled suite
+    :param covercode: ENV_COVERCODE of the mission
+    :param validator: validator class
+    :param handler_cls: handler class
+    :param options: other settings which change the sent events
+    :return: hex digest
+    """
+    data = json.dumps([code, env_name, tests, covercode, _qualified_name(validator),
+                       _qualified_name(handler_cls), options], sort_keys=True, default=repr)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class BaseVerdictCache(object):
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, events):
+        raise NotImplementedError
+
+    def invalidate(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryVerdictCache(BaseVerdictCache):
+    """
+    Verdicts in process memory with least-recently-used eviction.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._verdicts = OrderedDict()
+
+    def get(self, key):
+        events = self._verdicts.get(key)
+        if events is not None:
+            self._verdicts.move_to_end(key)
+        return events
+
+    def set(self, key, events):
+        self._verdicts[key] = events
+        self._verdicts.move_to_end(key)
+        while len(self._verdicts) > self.max_size:
+            self._verdicts.popitem(last=False)
+
+    def invalidate(self, key):
+        self._verdicts.pop(key, None)
+
+    def clear(self):
+        self._verdicts.clear()
+
+
+class FileVerdictCache(BaseVerdictCache):
+    """
+    Verdicts as JSON files in a directory, shared by referee processes on a host.
+
+    Files are read and written by a background thread, one by one, so a verdict set
+    by the process is seen by its next get. get() returns a Future.
+    """
+
+    SUFFIX = '.json'
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._executor = ThreadPoolExecutor(1)
+
+    def _file_path(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def get(self, key):
+        return self._executor.submit(self._read, key)
+
+    def set(self, key, events):
+        self._executor.submit(self._write, key, events)
+
+    def invalidate(self, key):
+        self._executor.submit(self._remove, key)
+
+    def clear(self):
+        self._executor.submit(self._remove_all)
+
+    def flush(self):
+        """
+        Wait for the files of previous calls to be written.
+        """
+        self._executor.submit(lambda: None).result()
+
+    def _read(self, key):
+        try:
+            with open(self._file_path(key), encoding='utf-8') as verdict_file:
+                return json.load(verdict_file)
+        except (IOError, ValueError):
+            return None
+
+    def _write(self, key, events):
+        file_path = self._file_path(key)
+        tmp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+        with open(tmp_path, 'w', encoding='utf-8') as verdict_file:
+            json.dump(events, verdict_file)
+        os.replace(tmp_path, file_path)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._file_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _remove_all(self):
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(self.SUFFIX):
+                self._remove(file_name[:-len(self.SUFFIX)])
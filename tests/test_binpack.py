@@ -0,0 +1,57 @@
+import unittest
+
+from checkio_referee.utils import binpack
+
+INTS = [0, 127, 128, 255, 256, 0xffff, 0x10000, 0xffffffff, 0x100000000, 0xffffffffffffffff,
+        -1, -32, -33, -128, -129, -0x8000, -0x8001, -0x80000000, -0x80000001,
+        -0x8000000000000000]
+BIG_INTS = [0x10000000000000000, -0x8000000000000001, 10 ** 100, -10 ** 100]
+LENGTHS = [0, 15, 16, 31, 32, 255, 256, 0xffff, 0x10000]
+
+
+def values():
+    yield from INTS
+    yield from BIG_INTS
+    yield from (None, True, False, 0.5, -1e300, float('inf'))
+    for length in LENGTHS:
+        yield 'é' * (length // 2) + 'a' * (length % 2)
+        yield b'\xff' * length
+        yield list(range(length))
+        yield dict((str(number), number) for number in range(length))
+    yield {1: [{'nested': (1, 2)}, None], 'big': [10 ** 30]}
+
+
+def unpacked(value):
+    # arrays are unpacked as lists
+    if isinstance(value, (list, tuple)):
+        return [unpacked(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, unpacked(item)) for key, item in value.items())
+    return value
+
+
+class BinpackTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        for value in values():
+            self.assertEqual(binpack._py_unpackb(binpack._py_packb(value)), unpacked(value))
+
+    @unittest.skipIf(binpack.msgpack is None, "msgpack is not installed")
+    def test_same_as_msgpack(self):
+        for value in values():
+            packed = binpack._py_packb(value)
+            self.assertEqual(packed, binpack.packb(value))
+            self.assertEqual(binpack.unpackb(packed), unpacked(value))
+
+    def test_broken_data(self):
+        packed = binpack._py_packb(['text', 10 ** 30])
+        with self.assertRaises(ValueError):
+            binpack._py_unpackb(packed[:-1])
+        with self.assertRaises(ValueError):
+            binpack._py_unpackb(packed + b'\xc0')
+        with self.assertRaises(TypeError):
+            binpack._py_packb(object())
+
+
+if __name__ == '__main__':
+    unittest.main()
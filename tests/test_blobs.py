@@ -0,0 +1,34 @@
+import json
+import unittest
+
+from tornado.escape import json_encode
+
+from checkio_referee.environment.blobs import EncodedValue, encode_message
+
+
+class EncodeMessageTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        value = [list(range(100)), {'text': '</script>'}]
+        message = {
+            'function_name': '\0encoded:0\0',
+            'function_args': EncodedValue(value),
+            'calls': [{1: EncodedValue('\0encoded:1\0'), 'args': (EncodedValue(None),)}],
+            'code': '</script>',
+        }
+        encoded = encode_message(message)
+        self.assertNotIn('</', encoded)
+        self.assertEqual(json.loads(encoded), {
+            'function_name': '\0encoded:0\0',
+            'function_args': value,
+            'calls': [{'1': '\0encoded:1\0', 'args': [None]}],
+            'code': '</script>',
+        })
+
+    def test_without_encoded_values(self):
+        message = {'action': 'run_code', 'code': '</script>', 'args': [1, 2.5, None]}
+        self.assertEqual(encode_message(message), json_encode(message))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from checkio_referee import exceptions
+from checkio_referee.handlers.golf import CodeGolfCheckHandler
+from checkio_referee.handlers.rank import RankCheckHandler
+from checkio_referee.utils import history
+from checkio_referee.utils.verdicts import FileVerdictCache, MemoryVerdictCache
+
+TESTS = {
+    'Rank_01': [{'input': [number], 'answer': number} for number in range(6)],
+    'Rank_02': [{'input': [number], 'answer': number} for number in range(6)],
+}
+# the wrong result of the code below
+WRONG_INPUT = [3]
+# the code below fails on it
+RUN_FAIL_INPUT = [-1]
+
+
+class FakeEnvironment(object):
+    is_pipelined = False
+
+    def is_closed(self):
+        return False
+
+    @gen.coroutine
+    def set_config(self, env_config):
+        return {'status': 'success'}
+
+    @gen.coroutine
+    def run_code(self, code, env_config=None):
+        return {'status': 'success'}
+
+    @gen.coroutine
+    def run_func(self, function_name, params):
+        yield gen.moment
+        if params == RUN_FAIL_INPUT:
+            raise exceptions.EnvironmentRunFail({'status': 'fail'})
+        return {'status': 'success', 'result': None if params == WRONG_INPUT else params[0]}
+
+    @gen.coroutine
+    def run_func_batch(self, calls):
+        self.batch_calls = list(calls)
+
+    @gen.coroutine
+    def read_batch_result(self):
+        call = self.batch_calls.pop(0)
+        try:
+            result = yield self.run_func(call['function_name'], call['function_args'])
+        except exceptions.EnvironmentRunFail:
+            # the environment does not run the rest of the batch
+            self.batch_calls = None
+            raise
+        return result
+
+    @gen.coroutine
+    def stop(self):
+        pass
+
+
+class FakeController(object):
+
+    def is_valid_env(self, env_name):
+        return True
+
+    @gen.coroutine
+    def get_environment(self, env_name, on_stdout=None, on_stderr=None):
+        return FakeEnvironment()
+
+    @gen.coroutine
+    def release_environment(self, environment):
+        pass
+
+    def get_resource_usage(self, environment):
+        return {'cpu_user': 0.1, 'cpu_system': 0.1, 'max_rss': 1024}
+
+
+class FakeEditorClient(object):
+
+    def __init__(self):
+        self.post_tests = []
+        self.results = []
+
+    @gen.coroutine
+    def send_pre_test(self, data):
+        pass
+
+    @gen.coroutine
+    def send_post_test(self, data):
+        self.post_tests.append(data)
+
+    @gen.coroutine
+    def send_check_result(self, **kwargs):
+        self.results.append(kwargs)
+
+
+class FakeReferee(object):
+    environments_controller = FakeController()
+    TESTS = TESTS
+    RUN_TIMEOUT = 300
+    CHECK_TIMEOUT = None
+    ONE_TEST_TIMEOUT = 30
+    RESOURCE_USAGE = False
+
+    def __init__(self, **settings):
+        self.__dict__.update(settings)
+
+
+class MissionCheckHandler(RankCheckHandler):
+    """
+    Overrides check_test_item the way missions do.
+    """
+
+    @gen.coroutine
+    def check_test_item(self, environment, test, category_name, test_number):
+        test_passed = yield super().check_test_item(environment, test, category_name,
+                                                    test_number)
+        return test_passed
+
+
+def check(editor_client=None, handler_class=RankCheckHandler, **settings):
+    editor_client = editor_client or FakeEditorClient()
+    handler = handler_class({'env_name': 'python_3', 'code': 'code'}, editor_client,
+                            FakeReferee(**settings))
+    IOLoop.current().run_sync(handler.start)
+    return editor_client.results[-1]
+
+
+class RankCheckHandlerTestCase(unittest.TestCase):
+
+    def test_sharded_failed_category(self):
+        serial = check()
+        self.assertFalse(serial['success'])
+        self.assertIsNone(serial['points'])
+        self.assertEqual(check(PARALLEL_CATEGORIES=2, CATEGORY_SHARD_SIZE=2), serial)
+
+    def test_verdict_only_batch_run_fail(self):
+        tests = {'Rank_01': [{'input': [0], 'answer': 0}, {'input': [1], 'answer': 1},
+                             {'input': WRONG_INPUT, 'answer': 3},
+                             {'input': RUN_FAIL_INPUT, 'answer': -1}, {'input': [4], 'answer': 4}]}
+        test_stats = history.TestStatsStore()
+        test_stats.record(tests['Rank_01'][3], False, 0.1)
+        expected = check(VERDICT_ONLY=True, TESTS=tests)
+        self.assertEqual(check(VERDICT_ONLY=True, TESTS=tests, TEST_STATS=test_stats,
+                               TESTS_BATCH_SIZE=2), expected)
+        # the run failure went first, the tests before it still ran
+        self.assertEqual(test_stats.get(tests['Rank_01'][2])[:2], [1, 1])
+        self.assertEqual(test_stats.get(tests['Rank_01'][3])[:2], [2, 2])
+
+    def test_check_test_item_override(self):
+        for settings in ({}, {'PARALLEL_CATEGORIES': 2, 'CATEGORY_SHARD_SIZE': 2}):
+            expected, checked = FakeEditorClient(), FakeEditorClient()
+            self.assertEqual(check(checked, MissionCheckHandler, **settings),
+                             check(expected, **settings))
+            self.assertEqual(checked.post_tests, expected.post_tests)
+
+    def test_replay_without_resource_usage(self):
+        verdict_cache = MemoryVerdictCache()
+        checked = FakeEditorClient()
+        self.assertIn('resource_usage', check(checked, VERDICT_CACHE=verdict_cache,
+                                              RESOURCE_USAGE=True)['additional_data'])
+        self.assertIn('resource_usage', checked.post_tests[0])
+        replayed = FakeEditorClient()
+        self.assertNotIn('resource_usage', check(replayed, VERDICT_CACHE=verdict_cache,
+                                                 RESOURCE_USAGE=True)['additional_data'])
+        self.assertEqual(len(replayed.post_tests), len(checked.post_tests))
+        self.assertNotIn('resource_usage', replayed.post_tests[0])
+
+    def test_verdict_key_settings(self):
+        verdict_cache = MemoryVerdictCache()
+        tests = {'Rank_01': TESTS['Rank_01'][:3]}
+        for points in (100, 50):
+            self.assertEqual(check(VERDICT_CACHE=verdict_cache, TESTS=tests,
+                                   CATEGORY_POINTS={'Rank_01': points})['points'], points)
+        for base_points in (0, 10):
+            self.assertEqual(check(handler_class=CodeGolfCheckHandler,
+                                   VERDICT_CACHE=verdict_cache, TESTS=tests,
+                                   BASE_POINTS=base_points)['points'], 996 + base_points)
+
+    def test_replay_from_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            verdict_cache = FileVerdictCache(directory)
+            checked, replayed = FakeEditorClient(), FakeEditorClient()
+            result = check(checked, VERDICT_CACHE=verdict_cache)
+            verdict_cache.flush()
+            self.assertEqual(len(os.listdir(directory)), 1)
+            self.assertEqual(check(replayed, VERDICT_CACHE=verdict_cache), result)
+            self.assertEqual(replayed.post_tests, checked.post_tests)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
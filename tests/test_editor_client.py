@@ -0,0 +1,58 @@
+import unittest
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from checkio_referee.editor import packet
+from checkio_referee.editor.tcpclient import EditorClient
+
+
+class FakeStream(object):
+
+    def __init__(self):
+        self.methods = []
+
+    def closed(self):
+        return False
+
+    def write(self, data):
+        self.methods.append(packet.OutPacket.decode(
+            data[:-len(packet.DEFAULT_CODEC.TERMINATOR)], packet.DEFAULT_CODEC).method)
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+class EditorClientTestCase(unittest.TestCase):
+
+    def test_output_order(self):
+        client = EditorClient(None, None, 'connection', 'docker', IOLoop.current())
+        client._stream = stream = FakeStream()
+        # packets wait in the lanes until the client sends again
+        client._is_sending = True
+        client.send_pre_test({})
+        client.send_stdout('before post_test')
+        client.send_post_test({})
+        client.send_stdout('after post_test')
+        client.send_check_result(True, 'code')
+        client.send_stdout('after result')
+        client.send_pre_test({})
+        client._is_sending = False
+        IOLoop.current().run_sync(client._send_queued)
+        self.assertEqual(stream.methods, ['pre_test', 'stdout', 'post_test', 'stdout', 'result',
+                                          'stdout', 'pre_test'])
+
+    def test_output_of_other_sessions(self):
+        client = EditorClient(None, None, 'connection', 'docker', IOLoop.current())
+        client._stream = stream = FakeStream()
+        client._is_sending = True
+        for method, connection_id in ((packet.OutPacket.METHOD_STDOUT, 'first'),
+                                      (packet.OutPacket.METHOD_POST_TEST, 'second'),
+                                      (packet.OutPacket.METHOD_POST_TEST, 'first')):
+            client._send_packet(packet.OutPacket(method, {}, connection_id=connection_id))
+        client._is_sending = False
+        IOLoop.current().run_sync(client._send_queued)
+        self.assertEqual(stream.methods, ['post_test', 'stdout', 'post_test'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.queues import Queue
+
+from checkio_referee import exceptions
+from checkio_referee.environment.client import EnvironmentClient
+
+
+class FakeStream(object):
+    """
+    A pipelined environment which answers the first `results` calls of a batch
+    and exits.
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.messages = Queue()
+        self.is_closed = False
+
+    def closed(self):
+        return self.is_closed
+
+    @gen.coroutine
+    def write(self, data):
+        if self.is_closed:
+            return
+        for call in data.get('calls', ())[:self.results]:
+            self.messages.put_nowait({'status': 'success', 'request_id': data['request_id'],
+                                      'result': call['function_args']})
+        self.is_closed = True
+        self.messages.put_nowait(None)
+
+    @gen.coroutine
+    def read_message(self):
+        if self.is_closed and not self.messages.qsize():
+            return None
+        message = yield self.messages.get()
+        return message
+
+
+class BlobsStream(FakeStream):
+    """
+    A pipelined environment with a blob cache, which can be cleared to evict blobs.
+    """
+
+    def __init__(self):
+        super().__init__(0)
+        self.blobs = {}
+        self.actions = []
+
+    @gen.coroutine
+    def write(self, data):
+        self.actions.append(data['action'])
+        response = {'status': 'success', 'request_id': data['request_id']}
+        if data['action'] == 'blobs_check':
+            response['missing'] = [digest for digest in data['digests']
+                                   if digest not in self.blobs]
+        elif data['action'] == 'blobs_put':
+            self.blobs.update(data['blobs'])
+        elif 'function_args_digest' in data:
+            digest = data['function_args_digest']
+            if digest in self.blobs:
+                response['result'] = self.blobs[digest]
+            else:
+                response = {'status': 'fail', 'request_id': data['request_id'],
+                            'missing': [digest]}
+        else:
+            response['result'] = data['function_args']
+        self.messages.put_nowait(response)
+
+
+class EnvironmentClientTestCase(unittest.TestCase):
+
+    def test_blobs(self):
+        stream = BlobsStream()
+        client = EnvironmentClient(stream, 'environment',
+                                   [EnvironmentClient.CAPABILITY_REQUEST_ID,
+                                    EnvironmentClient.CAPABILITY_BLOBS])
+        big_args = list(range(EnvironmentClient.BLOB_MIN_SIZE))
+
+        @gen.coroutine
+        def run_func(args):
+            del stream.actions[:]
+            result = yield client.run_func('checkio', args)
+            return result['result'], list(stream.actions)
+
+        self.assertEqual(IOLoop.current().run_sync(lambda: run_func(big_args)),
+                         (big_args, ['blobs_check', 'blobs_put', 'run_function']))
+        # the environment has the blob
+        self.assertEqual(IOLoop.current().run_sync(lambda: run_func(big_args)),
+                         (big_args, ['run_function']))
+        self.assertEqual(IOLoop.current().run_sync(lambda: run_func([1])),
+                         ([1], ['run_function']))
+        # the environment evicted it, the request is sent again after the blob
+        stream.blobs.clear()
+        self.assertEqual(IOLoop.current().run_sync(lambda: run_func(big_args)),
+                         (big_args, ['run_function', 'blobs_check', 'blobs_put',
+                                     'run_function']))
+
+    def test_batch_after_close(self):
+        client = EnvironmentClient(FakeStream(2), 'environment',
+                                   [EnvironmentClient.CAPABILITY_REQUEST_ID])
+
+        @gen.coroutine
+        def run():
+            yield client.run_func_batch([{'function_name': 'checkio', 'function_args': [number]}
+                                         for number in range(6)])
+            results = []
+            for _ in range(6):
+                try:
+                    result = yield client.read_batch_result()
+                except exceptions.EnvironmentRunFail:
+                    result = None
+                results.append(result and result['result'])
+            try:
+                yield gen.with_timeout(IOLoop.current().time() + 1,
+                                       client.run_func('checkio', [0]))
+            except exceptions.EnvironmentRunFail:
+                results.append('failed')
+            return results
+
+        self.assertEqual(IOLoop.current().run_sync(run),
+                         [[0], [1], None, None, None, None, 'failed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
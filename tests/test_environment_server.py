@@ -0,0 +1,59 @@
+import json
+import socket
+import unittest
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import IOStream
+
+from checkio_referee.environment.tcpserver import EnvironmentsTCPServer, StreamHandler
+
+BIG_MESSAGE = {'result': 'x' * 100}
+
+
+def frame(data):
+    data = json.dumps(data).encode('utf-8')
+    return StreamHandler.frame_header.pack(len(data)) + data
+
+
+class StreamHandlerTestCase(unittest.TestCase):
+
+    def test_frames(self):
+        server = EnvironmentsTCPServer(max_frame_size=64)
+        connection_message = Future()
+        server.set_connection_message_callback(
+            lambda data, handler: connection_message.set_result(data))
+        referee_socket, environment_socket = socket.socketpair()
+        environment_stream = IOStream(environment_socket)
+        handler = StreamHandler(IOStream(referee_socket), None, server)
+        handler.SKIP_CHUNK_SIZE = 16
+
+        @gen.coroutine
+        def run():
+            yield environment_stream.write(b'{"capabilities": ["framing"]}\0')
+            yield connection_message
+            yield environment_stream.write(frame(BIG_MESSAGE) + frame({'result': 'y'}))
+            messages = [(yield handler.read_message()), (yield handler.read_message())]
+            yield handler.write({'action': 'stop'})
+            header = yield environment_stream.read_bytes(StreamHandler.frame_header.size)
+            data = yield environment_stream.read_bytes(
+                StreamHandler.frame_header.unpack(header)[0])
+            return messages, json.loads(data.decode('utf-8'))
+
+        try:
+            messages, written = IOLoop.current().run_sync(run)
+        finally:
+            environment_stream.close()
+            handler.close()
+        self.assertTrue(handler.is_framed)
+        self.assertEqual(messages[0]['status'], 'fail')
+        self.assertEqual(messages[0]['description'],
+                         'Message size {} exceeds the limit of 64 bytes'.format(
+                             len(frame(BIG_MESSAGE)) - StreamHandler.frame_header.size))
+        self.assertEqual(messages[1], {'result': 'y'})
+        self.assertEqual(written, {'action': 'stop'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from checkio_referee.utils import history
+
+
+class TestStatsStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'stats.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_file(self):
+        # a file saved as one JSON object before
+        with open(self.path, 'w') as stats_file:
+            json.dump({'key': [1, 1, 1.0]}, stats_file)
+        stores = [history.TestStatsStore(self.path, save_interval=0, compact_lines=3)
+                  for _ in range(2)]
+        for _ in range(5):
+            for store in stores:
+                store.record('key', True, 1.0)
+                store.save()
+                store.flush()
+        self.assertEqual(history.TestStatsStore(self.path).get('key'), [11, 1, 11.0])
+
+    def test_save_interval(self):
+        store = history.TestStatsStore(self.path, save_interval=60)
+        store.record('key', False, 1.0)
+        store.save()
+        store.flush()
+        store.record('key', True, 1.0)
+        store.save()
+        self.assertEqual(history.TestStatsStore(self.path).get('key'), [1, 1, 1.0])
+        self.assertEqual(store.get('key'), [2, 1, 2.0])
+        store.flush()
+        self.assertEqual(history.TestStatsStore(self.path).get('key'), [2, 1, 2.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
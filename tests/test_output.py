@@ -0,0 +1,59 @@
+import unittest
+
+from checkio_referee.environment.output import OutputCapture
+
+STDOUT, STDERR = OutputCapture.STDOUT, OutputCapture.STDERR
+
+
+class OutputCaptureTestCase(unittest.TestCase):
+
+    def test_split_character(self):
+        capture = OutputCapture()
+        data = u'aéb€'.encode('utf-8')
+        self.assertEqual(capture.feed(STDOUT, data[:2]), u'a')
+        self.assertEqual(capture.feed(STDOUT, data[2:5]), u'éb')
+        self.assertEqual(capture.feed(STDOUT, data[5:6]), u'')
+        self.assertEqual(capture.feed(STDOUT, data[6:]), u'€')
+        # an incomplete character at the end of the stream
+        self.assertEqual(capture.feed(STDERR, data[:2]), u'a')
+        self.assertEqual(capture.finish(STDERR), u'�')
+
+    def test_exact_limit(self):
+        capture = OutputCapture(limit=4)
+        self.assertEqual(capture.feed(STDOUT, b'ab'), u'ab')
+        self.assertEqual(capture.feed(STDERR, b'cd'), u'cd')
+        self.assertTrue(capture.is_truncated)
+        self.assertEqual(capture.dropped, 0)
+        self.assertEqual(capture.truncation_marker(), u'')
+        self.assertEqual(capture.feed(STDOUT, b'e'), u'')
+        self.assertEqual(capture.forwarded, 4)
+
+    def test_dropped_bytes_marker(self):
+        capture = OutputCapture(limit=3, drain_limit=4)
+        # the limit cuts a character, its bytes are not forwarded
+        self.assertEqual(capture.feed(STDOUT, u'abé'.encode('utf-8')), u'ab')
+        self.assertEqual(capture.finish(STDOUT), u'')
+        self.assertFalse(capture.is_drained)
+        self.assertEqual(capture.feed(STDERR, b'xyz'), u'')
+        self.assertEqual(capture.dropped, 4)
+        self.assertTrue(capture.is_drained)
+        self.assertEqual(capture.truncation_marker(), u'\n... 4 bytes of output dropped\n')
+
+    def test_summary(self):
+        capture = OutputCapture(limit=0, keep_size=4)
+        capture.feed(STDOUT, b'0123')
+        self.assertEqual(capture.summary(STDOUT), u'0123')
+        capture.feed(STDOUT, b'45')
+        capture.feed(STDOUT, b'6789')
+        self.assertEqual(capture.summary(STDOUT), u'0123\n... 2 bytes skipped ...\n6789')
+        self.assertEqual(capture.summary(STDERR), u'')
+
+    def test_summary_cut_characters(self):
+        capture = OutputCapture(keep_size=3)
+        capture.feed(STDOUT, u'abéééécd'.encode('utf-8'))
+        # the characters cut by the head and the tail are counted as skipped
+        self.assertEqual(capture.summary(STDOUT), u'ab\n... 8 bytes skipped ...\ncd')
+
+
+if __name__ == '__main__':
+    unittest.main()
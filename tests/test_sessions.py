@@ -0,0 +1,89 @@
+import json
+import unittest
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+from tornado.tcpserver import TCPServer
+
+from checkio_referee import RefereeBase, RefereeSessionManager
+
+
+class Referee(RefereeBase):
+    ENVIRONMENTS = {'python_3': 'python3'}
+    ENVIRONMENTS_PORT = 0
+
+
+class EditorServer(TCPServer):
+    """
+    Closes the first connection after its first packet.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.connections = 0
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        self.connections += 1
+        yield stream.read_until(b'\n')
+        if self.connections == 1:
+            stream.close()
+
+
+class BadPacketsEditorServer(EditorServer):
+    """
+    Starts a session twice and answers a request nobody sent before starting another one.
+    """
+    PACKETS = (
+        {'method': 'start_session', 'data': {'user_connection_id': 'first'}},
+        {'method': 'start_session', 'data': {'user_connection_id': 'first'}},
+        {'method': 'select_result', 'data': {}, 'request_id': 'unknown',
+         'connection_id': 'first'},
+        {'method': 'start_session', 'data': {'user_connection_id': 'second'}},
+    )
+
+    @gen.coroutine
+    def handle_stream(self, stream, address):
+        self.connections += 1
+        yield stream.read_until(b'\n')
+        for pkt in self.PACKETS:
+            yield stream.write(json.dumps(pkt).encode('utf-8') + b'\n')
+
+
+class RefereeSessionManagerTestCase(unittest.TestCase):
+
+    def run_manager(self, server, until):
+        io_loop = IOLoop.current()
+        sockets = bind_sockets(0, '127.0.0.1')
+        server.add_sockets(sockets)
+        manager = RefereeSessionManager(Referee, '127.0.0.1', sockets[0].getsockname()[1],
+                                        'docker', io_loop=io_loop)
+
+        @gen.coroutine
+        def run():
+            yield manager.start()
+            for _ in range(100):
+                if until(manager):
+                    break
+                yield gen.sleep(0.01)
+
+        try:
+            io_loop.run_sync(run)
+        finally:
+            server.stop()
+        return manager
+
+    def test_reconnect(self):
+        server = EditorServer()
+        self.run_manager(server, lambda manager: server.connections > 1)
+        self.assertEqual(server.connections, 2)
+
+    def test_bad_packets(self):
+        server = BadPacketsEditorServer()
+        manager = self.run_manager(server, lambda manager: len(manager.sessions) > 1)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual(sorted(manager.sessions), ['first', 'second'])
+
+if __name__ == '__main__':
+    unittest.main()
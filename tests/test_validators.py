@@ -0,0 +1,42 @@
+import unittest
+
+from checkio_referee.utils.validators import (EqualValidator, FloatEqualValidator,
+                                              ValidatorResult)
+
+
+class SortedEqualValidator(EqualValidator):
+
+    def __init__(self, test_data):
+        super().__init__(test_data)
+        self.answer = sorted(test_data['answer'])
+
+    def validate(self, outer_result):
+        return ValidatorResult(self.answer == sorted(outer_result))
+
+
+class EqualValidatorTestCase(unittest.TestCase):
+
+    def test_subclass_validate_many(self):
+        tests = [{'answer': [2, 1]}, {'answer': [4, 3]}]
+        results = [[1, 2], [3, 4]]
+        self.assertEqual([SortedEqualValidator(test).validate(result).test_passed
+                          for test, result in zip(tests, results)], [True, True])
+        self.assertEqual([validator_result.test_passed for validator_result in
+                          SortedEqualValidator.validate_many(tests, results)], [True, True])
+
+    def test_reusable_not_inherited(self):
+        self.assertTrue(EqualValidator.is_reusable())
+        self.assertFalse(SortedEqualValidator.is_reusable())
+
+
+class FloatEqualValidatorTestCase(unittest.TestCase):
+
+    def test_big_ints(self):
+        answer = [10 ** 400] + [0.5] * FloatEqualValidator.NUMPY_MIN_SIZE
+        validator = FloatEqualValidator({'answer': answer})
+        self.assertTrue(validator.validate(list(answer)).test_passed)
+        self.assertFalse(validator.validate([10 ** 400 + 1] + answer[1:]).test_passed)
+
+
+if __name__ == '__main__':
+    unittest.main()
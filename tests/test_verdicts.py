@@ -0,0 +1,35 @@
+import shutil
+import tempfile
+import unittest
+
+from checkio_referee.utils.verdicts import FileVerdictCache
+
+EVENTS = [['pre_test', {'in': [1]}], ['result', {'success': True}]]
+
+
+class FileVerdictCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_background_files(self):
+        cache = FileVerdictCache(self.directory)
+        self.assertIsNone(cache.get('key').result())
+        cache.set('key', EVENTS)
+        # calls of the process are done in order
+        self.assertEqual(cache.get('key').result(), EVENTS)
+        cache.flush()
+        self.assertEqual(FileVerdictCache(self.directory).get('key').result(), EVENTS)
+        cache.invalidate('key')
+        self.assertIsNone(cache.get('key').result())
+        cache.set('key', EVENTS)
+        cache.clear()
+        cache.flush()
+        self.assertIsNone(FileVerdictCache(self.directory).get('key').result())
+
+
+if __name__ == '__main__':
+    unittest.main()